@@ -1,16 +1,30 @@
+import contextlib
 import importlib.metadata
 import logging as log
 import os
 import re
+import sqlite3
 import sys
-from typing import Optional
+from typing import List, Optional
 
 import typer
 from tqdm import tqdm
 from typing_extensions import Annotated
 
-from graver.memorial import Memorial, MemorialMergedException
-from graver.parsers import MemorialParser
+from graver import database, dedupe, sitemap, stats
+from graver.crawl import DEFAULT_WORKERS, crawl_family
+from graver.family import FamilyLink
+from graver.fetcher import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_PROXY_RATE,
+    DEFAULT_READ_TIMEOUT,
+    Fetcher,
+    ProxyPool,
+)
+from graver.memorial import MemorialMergedException
+from graver.parsers import get_id_from_url  # noqa: F401
+from graver.parsers import CemeteryParser, MemorialParser
+from graver.writers import OUTPUT_FORMATS, MemorialWriter
 
 # Constants
 DEFAULT_DB_FILE_NAME = "graves.db"
@@ -65,72 +79,217 @@ def common(
 # TODO: Configure output database name
 
 
-def get_id_from_url(url: str):
-    result = None
-    old_style = ".*?GRid=([0-9]+)/?$"
-    new_style = MemorialParser.DEFAULT_URL_FORMAT.format("([0-9]+)/?")
-    if re.match(old_style, url):  # oldstyle URL format
-        result = int(re.match(old_style, url).group(1))
-    elif re.match(new_style, url):
-        result = int(re.match(new_style, url).group(1))
-    return result
-
-    # def get_urls_from_gedcom(gedfile: str):
-    # TODO add gedcom input support
-    # # read from gedcom
-    # with open('tree.ged', encoding='utf8') as ged:
-    #     for line in ged.readlines():
-    #         num_memorials+=1
-    #         if '_LINK ' in line and 'findagrave.com' in line:
-    #             for unit in line.split('&'):
-    #                 if 'GRid=' in unit:
-    #                     if unit[5:-1] not in graveids:
-    #                         graveids.append(unit[5:-1])
-    #                         #print(graveids[numids])
-    #                         numids+=1
-    # return
+# def get_urls_from_gedcom(gedfile: str):
+# TODO add gedcom input support
+# # read from gedcom
+# with open('tree.ged', encoding='utf8') as ged:
+#     for line in ged.readlines():
+#         num_memorials+=1
+#         if '_LINK ' in line and 'findagrave.com' in line:
+#             for unit in line.split('&'):
+#                 if 'GRid=' in unit:
+#                     if unit[5:-1] not in graveids:
+#                         graveids.append(unit[5:-1])
+#                         #print(graveids[numids])
+#                         numids+=1
+# return
 
 
-@app.command()
-def scrape(input_filename: str, db: Annotated[Optional[str], typer.Argument()] = None):
-    """Scrape URLs from a file"""
-    print(f"Input file: {input_filename}")
+def open_input(filename: str):
+    """Opens filename for reading, or stdin if filename is "-" """
+    if filename == "-":
+        return contextlib.nullcontext(sys.stdin)
+    return open(filename)
+
 
-    urls = []
+def iter_urls(file):
+    """Yields each memorial URL or ID in file once, as a URL, as it is read"""
+    seen = set()
+    while line := file.readline():
+        line = line.strip()
+        if line == "":
+            continue
+        if re.match("^[0-9]+$", line):  # id only
+            line = MemorialParser.DEFAULT_URL_FORMAT.format(line)
+        if line not in seen:
+            seen.add(line)
+            yield line
 
+
+def use_database(db: Optional[str]) -> str:
+    """Returns the database to use, creating its tables if necessary"""
     if db is None:
         db = os.getenv("DATABASE_NAME")
         if db is None:
             db = DEFAULT_DB_FILE_NAME
     else:
         os.environ["DATABASE_NAME"] = db
-    Memorial.create_table(db)
+    database.create_tables(db)
+    return db
+
+
+def make_fetcher(
+    connect_timeout: float,
+    read_timeout: float,
+    hedge: bool = False,
+    proxy: Optional[List[str]] = None,
+    proxy_rate: float = DEFAULT_PROXY_RATE,
+) -> Fetcher:
+    proxies = ProxyPool.from_urls(proxy, proxy_rate) if proxy else None
+    return Fetcher(
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        hedge=hedge,
+        proxies=proxies,
+    )
+
+
+def print_proxy_summary(fetcher: Fetcher):
+    if fetcher.proxies is None:
+        return
+    for proxy in fetcher.proxies.proxies:
+        msg = "Proxy {url}: {ok} ok, {failed} failed, p95={p95}"
+        p95 = proxy.latency.percentile(95)
+        print(
+            msg.format(
+                url=proxy.url,
+                ok=proxy.successes,
+                failed=proxy.failures,
+                p95="-" if p95 is None else "{:.2f}s".format(p95),
+            )
+        )
+
+
+def print_latency_summary(fetcher: Fetcher):
+    if len(fetcher.page_latency) == 0:
+        return
+    msg = "Page latency p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s ({hedges} hedged)"
+    print(
+        msg.format(
+            p50=fetcher.page_latency.percentile(50),
+            p95=fetcher.page_latency.percentile(95),
+            p99=fetcher.page_latency.percentile(99),
+            hedges=fetcher.hedges,
+        )
+    )
 
-    # Main loop
-    with open(input_filename) as file:
-        while line := file.readline():
-            line = line.strip()
-            if re.match("^[0-9]+$", line):  # id only
-                line = MemorialParser.DEFAULT_URL_FORMAT.format(line)
-            if line not in urls:
-                urls.append(line)
 
+@app.command()
+def scrape(
+    input_filename: str,
+    db: Annotated[Optional[str], typer.Argument()] = None,
+    connect_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait for a connection and headers.")
+    ] = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait on each read of a page body.")
+    ] = DEFAULT_READ_TIMEOUT,
+    proxy: Annotated[
+        Optional[List[str]],
+        typer.Option(help="HTTP proxy to send requests through; may be repeated."),
+    ] = None,
+    proxy_rate: Annotated[
+        float, typer.Option(help="Maximum requests per second through each proxy.")
+    ] = DEFAULT_PROXY_RATE,
+    hedge: Annotated[
+        bool, typer.Option(help="Duplicate requests slower than the running p95.")
+    ] = False,
+    output: Annotated[
+        Optional[str],
+        typer.Option(help="Write memorials as jsonl or csv instead of saving them."),
+    ] = None,
+    output_file: Annotated[
+        str, typer.Option(help="File to write --output to, or - for stdout.")
+    ] = "-",
+    compress: Annotated[
+        Optional[bool],
+        typer.Option(
+            help="gzip --output; on by default for .gz files.", show_default=False
+        ),
+    ] = None,
+):
+    """Scrape URLs from a file, or from stdin if the file is -"""
+    if output is not None and output not in OUTPUT_FORMATS:
+        raise typer.BadParameter(f"Unknown output format {output}")
+    if output is not None and db is not None:
+        raise typer.BadParameter("--output writes memorials instead of a database")
+
+    try:
+        with contextlib.ExitStack() as stack:
+            writer = None
+            if output is not None:
+                writer = stack.enter_context(
+                    MemorialWriter(output_file, output, compress)
+                )
+                if output_file == "-":
+                    # stdout carries the memorials, so report progress on stderr
+                    stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+            else:
+                use_database(db)
+            scrape_urls(
+                input_filename,
+                writer,
+                connect_timeout,
+                read_timeout,
+                proxy,
+                proxy_rate,
+                hedge,
+            )
+            # while redirected, this flushes the progress report on stderr
+            sys.stdout.flush()
+    except OSError as ex:
+        if output is None:
+            raise
+        # e.g. a full disk or a closed pipe; stop rather than lose more pages
+        typer.echo(f"Scrape stopped: {ex}", err=True)
+        raise typer.Exit(code=1)
+
+
+def scrape_urls(
+    input_filename: str,
+    writer: Optional[MemorialWriter],
+    connect_timeout: float,
+    read_timeout: float,
+    proxy: Optional[List[str]],
+    proxy_rate: float,
+    hedge: bool,
+):
+    print(f"Input file: {input_filename}")
+
+    fetcher = make_fetcher(connect_timeout, read_timeout, hedge, proxy, proxy_rate)
+    expected = 0
     parsed = 0
     failed_urls = []
-    for url in (pbar := tqdm(urls)):
-        try:
-            pbar.set_postfix_str(url)
-            MemorialParser().parse(url).save()
+    # Main loop: URLs are fetched as they are read, so input can be streamed
+    with open_input(input_filename) as file:
+        for url in (pbar := tqdm(iter_urls(file))):
+            expected += 1
+            try:
+                pbar.set_postfix_str(url)
+                parser = MemorialParser(fetcher)
+                memorial = parser.parse(url)
+            except MemorialMergedException as ex:
+                log.warning(ex)
+                continue
+            except Exception as ex:
+                out = "Unable to parse Memorial []" + url + "]!"
+                log.error(out, ex)
+                failed_urls.append(url)
+                continue
+            # errors writing the output stop the run, as later pages would
+            # be lost as well
+            if writer is not None:
+                writer.write(memorial)
+            else:
+                memorial.save()
+                FamilyLink.save_family(memorial.id, parser.family)
             parsed += 1
-        except MemorialMergedException as ex:
-            log.warning(ex)
-        except Exception as ex:
-            out = "Unable to parse Memorial []" + url + "]!"
-            log.error(out, ex)
-            failed_urls.append(url)
+    fetcher.close()
 
     msg = "Successfully parsed {total} of {expected}"
-    print(msg.format(total=parsed, expected=len(urls)))
+    print(msg.format(total=parsed, expected=expected))
+    print_latency_summary(fetcher)
+    print_proxy_summary(fetcher)
     # out = "Successfully parsed " + str(parsed) + " of "
     # out += str(len(urls))
     # print(out)
@@ -139,5 +298,191 @@ def scrape(input_filename: str, db: Annotated[Optional[str], typer.Argument()] =
         print(*failed_urls, sep="\n")
 
 
+@app.command()
+def merge(output: str, shards: List[str]):
+    """Merge shard databases into a single database"""
+    for shard in shards:
+        if os.path.abspath(shard) == os.path.abspath(output):
+            raise typer.BadParameter(f"{shard} is the output database")
+        if not os.path.isfile(shard):
+            raise typer.BadParameter(f"{shard} does not exist")
+    counts = database.merge(output, shards)
+    msg = "Merged {graves} memorials and {cemeteries} cemeteries from {n} shards"
+    print(msg.format(n=len(shards), **counts))
+
+
+@app.command("import")
+def import_command(
+    input_filename: str,
+    db: Annotated[Optional[str], typer.Argument()] = None,
+    file_format: Annotated[
+        Optional[str],
+        typer.Option("--format", help="csv or jsonl; guessed from the file name."),
+    ] = None,
+    batch_size: Annotated[
+        int, typer.Option(help="Rows to load per transaction.")
+    ] = database.DEFAULT_BATCH_SIZE,
+):
+    """Import memorials from a CSV or JSONL file"""
+    db = use_database(db)
+    try:
+        counts = database.bulk_import(db, input_filename, file_format, batch_size)
+    except database.DatabaseException as ex:
+        raise typer.BadParameter(str(ex))
+    rate = counts["imported"] / counts["seconds"] if counts["seconds"] > 0 else 0
+    msg = "Imported {imported} rows ({rejected} rejected) in {seconds:.1f}s"
+    print(msg.format(**counts) + " ({:.0f} rows/sec)".format(rate))
+
+
+@app.command("stats")
+def stats_command(
+    db: Annotated[Optional[str], typer.Argument()] = None,
+    by: Annotated[
+        Optional[str],
+        typer.Option(help="One of: " + ", ".join(stats.DIMENSIONS) + "."),
+    ] = None,
+    limit: Annotated[int, typer.Option(help="Maximum number of rows to show.")] = 20,
+    rebuild: Annotated[
+        bool, typer.Option("--rebuild", help="Recompute statistics from scratch.")
+    ] = False,
+):
+    """Show summary statistics about the memorials in the database"""
+    if by is not None and by not in stats.DIMENSIONS:
+        raise typer.BadParameter(f"Unknown statistic {by}")
+    db = use_database(db)
+    conn = sqlite3.connect(db)
+    if rebuild:
+        stats.rebuild(conn)
+    if by is None:
+        total = stats.get_stats(conn, "total")
+        coords = dict(stats.get_stats(conn, "coords"))
+        print("Memorials: {}".format(total[0][1] if total else 0))
+        print("With coordinates: {}".format(coords.get("yes", 0)))
+        print("Without coordinates: {}".format(coords.get("no", 0)))
+    else:
+        for key, count in stats.get_stats(conn, by, limit):
+            print("{}\t{}".format(key if key != "" else "(unknown)", count))
+    conn.close()
+
+
+@app.command("dedupe")
+def dedupe_command(
+    db: Annotated[Optional[str], typer.Argument()] = None,
+    threshold: Annotated[
+        float, typer.Option(help="Minimum similarity score, between 0 and 1.")
+    ] = dedupe.DEFAULT_THRESHOLD,
+    workers: Annotated[
+        Optional[int], typer.Option(help="Number of processes [default: all CPUs].")
+    ] = None,
+    max_block_size: Annotated[
+        int, typer.Option(help="Skip blocks with more memorials than this.")
+    ] = dedupe.DEFAULT_MAX_BLOCK_SIZE,
+):
+    """Find memorials that are likely duplicates of each other"""
+    db = use_database(db)
+    counts = dedupe.find_duplicates(db, threshold, workers, max_block_size)
+    msg = "Found {pairs} candidate pairs in {blocks} blocks ({skipped} too large)"
+    print(msg.format(**counts))
+
+
+@app.command("discover")
+def discover_command(
+    sitemaps: Annotated[
+        List[str],
+        typer.Option("--sitemap", help="Sitemap URL or file; may be repeated."),
+    ],
+    output_file: Annotated[
+        str, typer.Option(help="File to write IDs to, or - for stdout.")
+    ] = "-",
+    kind: Annotated[
+        Optional[List[str]],
+        typer.Option(help="memorial (IDs, for scrape) or cemetery (URLs)."),
+    ] = None,
+    connect_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait for a connection and headers.")
+    ] = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait on each read of a sitemap.")
+    ] = DEFAULT_READ_TIMEOUT,
+    proxy: Annotated[
+        Optional[List[str]],
+        typer.Option(help="HTTP proxy to send requests through; may be repeated."),
+    ] = None,
+    proxy_rate: Annotated[
+        float, typer.Option(help="Maximum requests per second through each proxy.")
+    ] = DEFAULT_PROXY_RATE,
+):
+    """Discover memorial or cemetery IDs from sitemaps"""
+    kinds = set(kind) if kind else {"memorial"}
+    for k in kinds:
+        if k not in sitemap.KINDS:
+            raise typer.BadParameter(f"Unknown kind {k}")
+    # one kind per stream, so that a memorial stream can be piped to scrape
+    if len(kinds) > 1:
+        raise typer.BadParameter("Discover memorials and cemeteries separately")
+
+    fetcher = make_fetcher(
+        connect_timeout, read_timeout, proxy=proxy, proxy_rate=proxy_rate
+    )
+    counts = {k: 0 for k in sitemap.KINDS}
+    with contextlib.ExitStack() as stack:
+        if output_file == "-":
+            out = sys.stdout
+        else:
+            out = stack.enter_context(open(output_file, "w"))
+        for found, id in sitemap.discover(sitemaps, kinds, fetcher=fetcher):
+            # memorial IDs are written bare, as scrape expects them
+            if found == "memorial":
+                out.write(f"{id}\n")
+            else:
+                out.write(CemeteryParser.DEFAULT_URL_FORMAT.format(id) + "\n")
+            counts[found] += 1
+    fetcher.close()
+    msg = "Discovered {memorial} memorials and {cemetery} cemeteries"
+    typer.echo(msg.format(**counts), err=True)
+
+
+@app.command("crawl-family")
+def crawl_family_command(
+    memorial_id: int,
+    db: Annotated[Optional[str], typer.Argument()] = None,
+    depth: Annotated[
+        int, typer.Option(help="Number of family links to follow from the seed.")
+    ] = 2,
+    workers: Annotated[
+        int, typer.Option(help="Number of memorials to fetch concurrently.")
+    ] = DEFAULT_WORKERS,
+    connect_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait for a connection and headers.")
+    ] = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: Annotated[
+        float, typer.Option(help="Seconds to wait on each read of a page body.")
+    ] = DEFAULT_READ_TIMEOUT,
+    proxy: Annotated[
+        Optional[List[str]],
+        typer.Option(help="HTTP proxy to send requests through; may be repeated."),
+    ] = None,
+    proxy_rate: Annotated[
+        float, typer.Option(help="Maximum requests per second through each proxy.")
+    ] = DEFAULT_PROXY_RATE,
+):
+    """Crawl the family tree of a memorial"""
+    use_database(db)
+    fetcher = make_fetcher(
+        connect_timeout, read_timeout, proxy=proxy, proxy_rate=proxy_rate
+    )
+    with tqdm() as pbar:
+        counts = crawl_family(
+            memorial_id, depth, fetcher, workers, progress=lambda _: pbar.update()
+        )
+    fetcher.close()
+    msg = (
+        "Fetched {fetched} memorials, skipped {skipped} already saved, {failed} failed"
+    )
+    print(msg.format(**counts))
+    print_latency_summary(fetcher)
+    print_proxy_summary(fetcher)
+
+
 if __name__ == "__main__":
     typer.run(app)
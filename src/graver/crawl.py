@@ -0,0 +1,115 @@
+import logging as log
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from graver.family import FamilyLink
+from graver.fetcher import Fetcher
+from graver.memorial import MemorialMergedException
+from graver.parsers import MemorialParser
+
+DEFAULT_WORKERS = 4
+# ids per "WHERE id IN (...)" query, well below SQLite's variable limit
+SQL_VARIABLE_LIMIT = 500
+
+
+def get_saved_ids(ids: list) -> dict:
+    """Returns {id: has_family} for each of ids that is already in the database.
+
+    has_family is True if the memorial has stored family links.
+    """
+    saved = {}
+    con = sqlite3.connect(os.getenv("DATABASE_NAME", "graves.db"))
+    for start in range(0, len(ids), SQL_VARIABLE_LIMIT):
+        end = start + SQL_VARIABLE_LIMIT
+        chunk = ids[start:end]
+        cur = con.execute(
+            "SELECT id, EXISTS (SELECT 1 FROM family WHERE memorial_id = graves.id) "
+            + "FROM graves WHERE id IN ({})".format(",".join("?" * len(chunk))),
+            chunk,
+        )
+        saved.update((record[0], bool(record[1])) for record in cur)
+    con.close()
+    return saved
+
+
+def fetch_memorial(fetcher: Fetcher, memorial_id: int):
+    """Returns the parsed Memorial and its family links"""
+    parser = MemorialParser(fetcher)
+    memorial = parser.parse(MemorialParser.DEFAULT_URL_FORMAT.format(memorial_id))
+    return memorial, parser.family
+
+
+def crawl_family(
+    seed_id: int,
+    depth: int,
+    fetcher: Fetcher = None,
+    workers: int = DEFAULT_WORKERS,
+    progress=None,
+) -> dict:
+    """Breadth-first crawl of the family graph starting at seed_id.
+
+    Each level of the graph is fetched concurrently. A memorial is visited at
+    most once per crawl. Memorials already in the database with stored family
+    links are not fetched again; their stored links are followed instead.
+    Saved memorials without family links (e.g. from an import or a merge
+    of databases that predate the family table) are fetched again.
+
+    Args:
+        seed_id (int): the memorial to start from
+        depth (int): how many links away from the seed to go
+        fetcher (Fetcher): shared by all workers
+        workers (int): number of concurrent fetches
+        progress: optional callable, called with each memorial id processed
+
+    Returns:
+        dict: the number of memorials "fetched", "skipped" and "failed"
+    """
+    fetcher = fetcher if fetcher is not None else Fetcher()
+    counts = {"fetched": 0, "skipped": 0, "failed": 0}
+    visited = {seed_id}
+    frontier = [seed_id]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for level in range(depth + 1):
+            relatives = []
+            futures = {}
+            saved = get_saved_ids(frontier)
+            for memorial_id in frontier:
+                if saved.get(memorial_id, False):
+                    counts["skipped"] += 1
+                    relatives += FamilyLink.get_by_memorial_id(memorial_id)
+                    if progress is not None:
+                        progress(memorial_id)
+                else:
+                    if memorial_id in saved:
+                        log.info("Refetching [%s]: no stored family", memorial_id)
+                    futures[memorial_id] = executor.submit(
+                        fetch_memorial, fetcher, memorial_id
+                    )
+
+            for memorial_id, future in futures.items():
+                try:
+                    memorial, family = future.result()
+                    memorial.save()
+                    FamilyLink.save_family(memorial.id, family)
+                    visited.add(memorial.id)
+                    relatives += family
+                    counts["fetched"] += 1
+                except MemorialMergedException as ex:
+                    log.warning(ex)
+                    counts["failed"] += 1
+                except Exception as ex:
+                    log.error("Unable to parse Memorial [%s]: %s", memorial_id, ex)
+                    counts["failed"] += 1
+                if progress is not None:
+                    progress(memorial_id)
+
+            if level == depth:
+                break
+            frontier = []
+            for link in relatives:
+                if link.relative_id not in visited:
+                    visited.add(link.relative_id)
+                    frontier.append(link.relative_id)
+    return counts
@@ -0,0 +1,312 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import logging as log
+import sqlite3
+import sys
+import time
+
+from graver import dedupe, stats
+from graver.cemetery import Cemetery
+from graver.family import FamilyLink
+from graver.memorial import Memorial
+
+CEMETERY_COLUMNS = ["id", "url", "name", "location", "coords", "more_info"]
+IMPORT_FORMATS = ["csv", "jsonl"]
+DEFAULT_BATCH_SIZE = 100000
+
+
+class DatabaseException(Exception):
+    pass
+
+
+def create_tables(database_name="graves.db"):
+    """Creates every graver table that does not already exist"""
+    Memorial.create_table(database_name)
+    Cemetery.create_table(database_name)
+    FamilyLink.create_table(database_name)
+    stats.create_table(database_name)
+    dedupe.create_table(database_name)
+
+
+def table_columns(conn: sqlite3.Connection, table: str, schema: str = "main"):
+    """Returns the column names of schema.table, or [] if there is no such table"""
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def bulk_connection(database_name: str) -> sqlite3.Connection:
+    """Returns an autocommit connection tuned for bulk loading.
+
+    Callers manage their own transactions. Durability is only traded for speed
+    (no fsync, in-memory journal) while the database holds no memorials,
+    cemeteries or family links, since a load into an empty database can be
+    rerun from its source. Otherwise the rollback journal is kept, so that a
+    crash mid-load rolls back the last batch instead of corrupting rows that
+    were already there.
+    """
+    conn = sqlite3.connect(database_name, isolation_level=None)
+    if is_empty(conn):
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA journal_mode = MEMORY")
+    else:
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def is_empty(conn: sqlite3.Connection) -> bool:
+    """True if none of the data tables that exist in conn has any rows"""
+    for (table,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name IN "
+        + "('graves', 'cemeteries', 'family')"
+    ).fetchall():
+        if conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]:
+            return False
+    return True
+
+
+def drop_indexes(conn: sqlite3.Connection, table: str) -> list:
+    """Drops the secondary indexes on table and returns the SQL to recreate them"""
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        + "WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
+
+
+def merge(database_name: str, shards: list) -> dict:
+    """Merges one or more shard databases into database_name.
+
+    Each shard is ATTACHed and copied with set-based INSERT ... SELECT
+    statements inside a single transaction. When the same memorial appears in
+    more than one database, the row with the newest ``fetched`` timestamp
+    wins; rows without a timestamp lose to rows that have one, and otherwise
+    the later shard wins. Cemeteries are taken from the later shard, and
+    family links from every shard are kept. Summary statistics are rebuilt
+    once at the end rather than maintained row by row.
+
+    Args:
+        database_name (str): the output database, created if necessary
+        shards (list): paths of the shard databases to merge, in order
+
+    Returns:
+        dict: the number of "graves", "cemeteries" and "family" rows written
+    """
+    counts = {"graves": 0, "cemeteries": 0, "family": 0}
+    create_tables(database_name)
+
+    conn = bulk_connection(database_name)
+    try:
+        with stats.deferred(conn):
+            _merge_shards(conn, shards, counts)
+    finally:
+        conn.close()
+    return counts
+
+
+def _merge_shards(conn: sqlite3.Connection, shards: list, counts: dict):
+    for shard in shards:
+        conn.execute("ATTACH DATABASE ? AS shard", (shard,))
+        try:
+            conn.execute("BEGIN")
+            counts["graves"] += _merge_graves(conn)
+            counts["cemeteries"] += _merge_cemeteries(conn)
+            counts["family"] += _merge_family(conn)
+            conn.execute("COMMIT")
+        except sqlite3.Error as ex:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise DatabaseException(f"Unable to merge {shard}: {ex}") from ex
+        finally:
+            conn.execute("DETACH DATABASE shard")
+
+
+def _merge_graves(conn: sqlite3.Connection) -> int:
+    shard_columns = table_columns(conn, "graves", "shard")
+    if len(shard_columns) == 0:
+        return 0
+    missing = set(Memorial.COLUMNS) - set(shard_columns)
+    if missing:
+        raise sqlite3.DatabaseError(f"graves is missing columns {sorted(missing)}")
+
+    columns = ",".join(Memorial.COLUMNS)
+    selected = ",".join("s." + column for column in Memorial.COLUMNS)
+    fetched = "s.fetched" if "fetched" in shard_columns else "NULL"
+    cur = conn.execute(
+        f"""INSERT OR REPLACE INTO main.graves ({columns},fetched)
+        SELECT {selected},{fetched} FROM shard.graves AS s
+        LEFT JOIN main.graves AS g ON g.id = s.id
+        WHERE g.id IS NULL OR g.fetched IS NULL
+        OR ({fetched} IS NOT NULL AND {fetched} >= g.fetched)"""
+    )
+    return cur.rowcount
+
+
+def _merge_cemeteries(conn: sqlite3.Connection) -> int:
+    shard_columns = table_columns(conn, "cemeteries", "shard")
+    if len(shard_columns) == 0:
+        return 0
+    columns = ",".join(c for c in CEMETERY_COLUMNS if c in shard_columns)
+    cur = conn.execute(
+        f"""INSERT OR REPLACE INTO main.cemeteries ({columns})
+        SELECT {columns} FROM shard.cemeteries"""
+    )
+    return cur.rowcount
+
+
+def _merge_family(conn: sqlite3.Connection) -> int:
+    if len(table_columns(conn, "family", "shard")) == 0:
+        return 0
+    cur = conn.execute(
+        """INSERT OR IGNORE INTO main.family (memorial_id,relative_id,relationship)
+        SELECT memorial_id,relative_id,relationship FROM shard.family"""
+    )
+    return cur.rowcount
+
+
+def open_import_file(filename: str):
+    """Opens filename (or stdin for "-") as text, decompressing .gz files"""
+    if filename == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8", newline="")
+    return open(filename, encoding="utf-8", newline="")
+
+
+def guess_import_format(filename: str):
+    name = filename[:-3] if filename.endswith(".gz") else filename
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return None
+
+
+def read_rows(file, file_format: str):
+    """Yields one record per row of file: a dict for CSV, a JSON string for JSONL"""
+    if file_format == "csv":
+        for row in csv.DictReader(file):
+            # sqlite3 exports NULL as an empty field
+            yield {k: (v if v != "" else None) for k, v in row.items()}
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def validate_row(row: dict) -> tuple:
+    """Returns the row as a tuple of Memorial.COLUMNS followed by fetched.
+
+    Raises:
+        ValueError: if the row is malformed, has unknown columns or no valid id
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("record is not an object")
+    unknown = set(row) - set(Memorial.COLUMNS) - {"fetched"}
+    if unknown:
+        raise ValueError(f"unknown columns {sorted(unknown)}")
+    if row.get("id") is None:
+        raise ValueError("missing id")
+    values = [row.get(column) for column in Memorial.COLUMNS]
+    values[0] = int(values[0])
+    more_info = Memorial.COLUMNS.index("more_info")
+    if isinstance(values[more_info], str):
+        values[more_info] = values[more_info].lower() in ("1", "true")
+    values.append(row.get("fetched"))
+    return tuple(values)
+
+
+def bulk_import(
+    database_name: str,
+    filename: str,
+    file_format: str = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict:
+    """Streams memorials from a CSV or JSONL file into the graves table.
+
+    Rows are validated against Memorial.COLUMNS and written with
+    INSERT OR REPLACE in transactions of batch_size rows. Secondary indexes on
+    graves are dropped for the duration of the load and rebuilt at the end,
+    as are the summary statistics. Invalid rows are logged and skipped.
+
+    Args:
+        database_name (str): the database to load into, created if necessary
+        filename (str): a .csv or .jsonl file, optionally gzipped, or "-"
+        file_format (str): "csv" or "jsonl"; guessed from filename if None
+        batch_size (int): rows per transaction
+
+    Returns:
+        dict: the number of rows "imported" and "rejected", and "seconds" taken
+    """
+    file_format = file_format or guess_import_format(filename)
+    if file_format not in IMPORT_FORMATS:
+        raise DatabaseException(f"Unable to determine the format of {filename}")
+
+    counts = {"imported": 0, "rejected": 0, "seconds": 0.0}
+    start = time.monotonic()
+    # read the first row before touching the database, so a missing or
+    # unreadable file leaves the indexes and statistics alone
+    try:
+        file = open_import_file(filename)
+    except OSError as ex:
+        raise DatabaseException(f"Unable to open {filename}: {ex}")
+    with file:
+        rows = read_rows(file, file_format)
+        try:
+            first = list(itertools.islice(rows, 1))
+            rows = itertools.chain(first, rows)
+            _load_rows(database_name, rows, filename, counts, batch_size)
+        except OSError as ex:
+            raise DatabaseException(f"Unable to read {filename}: {ex}")
+    counts["seconds"] = time.monotonic() - start
+    return counts
+
+
+def _load_rows(database_name: str, rows, filename: str, counts: dict, batch_size: int):
+    create_tables(database_name)
+    columns = ",".join(Memorial.COLUMNS)
+    insert = (
+        f"INSERT OR REPLACE INTO graves ({columns},fetched) VALUES ("
+        + "?, " * len(Memorial.COLUMNS)
+        + "coalesce(?, strftime('%Y-%m-%d %H:%M:%f', 'now')))"
+    )
+
+    conn = bulk_connection(database_name)
+    indexes = drop_indexes(conn, "graves")
+    try:
+        with stats.deferred(conn):
+            batch = []
+            for line_number, row in enumerate(rows, 1):
+                try:
+                    batch.append(validate_row(row))
+                except (ValueError, TypeError) as ex:
+                    log.warning(
+                        "Skipping record %d of %s: %s", line_number, filename, ex
+                    )
+                    counts["rejected"] += 1
+                if len(batch) >= batch_size:
+                    _insert_batch(conn, insert, batch)
+                    counts["imported"] += len(batch)
+                    batch = []
+            _insert_batch(conn, insert, batch)
+            counts["imported"] += len(batch)
+    finally:
+        for sql in indexes:
+            conn.execute(sql)
+        conn.close()
+
+
+def _insert_batch(conn: sqlite3.Connection, insert: str, batch: list):
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(insert, batch)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
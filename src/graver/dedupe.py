@@ -0,0 +1,212 @@
+import logging as log
+import os
+import re
+import sqlite3
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+from multiprocessing import Pool
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_BLOCK_SIZE = 1000
+DEFAULT_YEAR_BUCKET = 5
+NAME_SUFFIXES = {"jr", "sr", "ii", "iii", "iv", "v"}
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(name: str) -> str:
+    """Returns the American Soundex code of name, e.g. "Robert" -> "R163" """
+    letters = re.sub("[^a-z]", "", name.lower())
+    if letters == "":
+        return ""
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit is not None and digit != previous:
+            code += digit
+        # h and w do not separate letters with the same code; vowels do
+        if letter not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+def normalize_name(name: str) -> str:
+    if name is None:
+        return ""
+    return " ".join(re.sub("[^a-z ]", " ", name.lower()).split())
+
+
+def surname(name: str) -> str:
+    """Returns the last word of name that isn't a suffix such as Jr or III"""
+    words = [w for w in normalize_name(name).split() if w not in NAME_SUFFIXES]
+    return words[-1] if words else ""
+
+
+def year(date: str):
+    """Returns the year of a date such as "9 Sep 1941", or None"""
+    if date is None:
+        return None
+    match = re.search("([0-9]{4})\\s*$", date)
+    return int(match.group(1)) if match else None
+
+
+def blocking_keys(record: tuple, bucket: int = DEFAULT_YEAR_BUCKET) -> list:
+    """Returns the blocking keys of a (id, name, birth, death, burial) record.
+
+    Two memorials are only compared if they share at least one key: the same
+    surname Soundex plus the same birth year bucket, death year bucket or
+    cemetery.
+    """
+    _, name, birth, death, burial = record
+    code = soundex(surname(name))
+    if code == "":
+        return []
+    keys = []
+    if year(birth) is not None:
+        keys.append(("birth", code, year(birth) // bucket))
+    if year(death) is not None:
+        keys.append(("death", code, year(death) // bucket))
+    if burial is not None and burial != "":
+        keys.append(("burial", code, burial))
+    return keys
+
+
+def _year_score(a, b) -> float:
+    if a is None or b is None:
+        return 0.5
+    return max(1.0 - abs(a - b) / 2.0, 0.0)
+
+
+def score(a: tuple, b: tuple) -> float:
+    """Returns a similarity between 0 and 1 of two records"""
+    name = SequenceMatcher(None, normalize_name(a[1]), normalize_name(b[1])).ratio()
+    birth = _year_score(year(a[2]), year(b[2]))
+    death = _year_score(year(a[3]), year(b[3]))
+    burial = 1.0 if a[4] is not None and a[4] == b[4] else 0.0
+    return 0.5 * name + 0.2 * birth + 0.2 * death + 0.1 * burial
+
+
+def key_text(key: tuple) -> str:
+    """Returns a blocking key as stored in the blocks table, e.g. "birth|S530|380" """
+    return "|".join(str(part) for part in key)
+
+
+def score_block(args) -> list:
+    """Returns the (id_a, id_b, score) pairs of a block scoring >= threshold.
+
+    Two memorials can share several keys. A pair is only scored in the block
+    of the first key they share, skipping keys of blocks too large to compare,
+    so that it is scored once.
+    """
+    key, block, threshold, skipped = args
+    keys = {record[0]: [key_text(k) for k in blocking_keys(record)] for record in block}
+    pairs = []
+    for a, b in combinations(block, 2):
+        first = next(k for k in keys[a[0]] if k in keys[b[0]] and k not in skipped)
+        if first != key:
+            continue
+        s = score(a, b)
+        if s >= threshold:
+            pairs.append((min(a[0], b[0]), max(a[0], b[0]), round(s, 4)))
+    return pairs
+
+
+def create_table(database_name="graves.db"):
+    conn = sqlite3.connect(database_name)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS duplicates
+        (id_a INTEGER, id_b INTEGER, score REAL, PRIMARY KEY (id_a, id_b))"""
+    )
+    conn.close()
+
+
+def _load_blocks(conn: sqlite3.Connection):
+    """Fills a temporary blocks table with one row per record and blocking key"""
+    conn.execute(
+        """CREATE TEMP TABLE blocks
+        (key TEXT, id INTEGER, name TEXT, birth TEXT, death TEXT, burial TEXT)"""
+    )
+    records = conn.cursor().execute("SELECT id, name, birth, death, burial FROM graves")
+    conn.executemany(
+        "INSERT INTO temp.blocks VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (key_text(key),) + record
+            for record in records
+            for key in blocking_keys(record)
+        ),
+    )
+    conn.execute("CREATE INDEX temp.blocks_key ON blocks (key)")
+    conn.commit()
+
+
+def _iter_blocks(conn: sqlite3.Connection, threshold: float, skipped: set):
+    """Yields the score_block() arguments of each block, one block at a time"""
+    rows = conn.execute(
+        "SELECT key, id, name, birth, death, burial FROM temp.blocks ORDER BY key"
+    )
+    for key, group in groupby(rows, key=lambda row: row[0]):
+        if key in skipped:
+            continue
+        block = [row[1:] for row in group]
+        if len(block) > 1:
+            yield key, block, threshold, skipped
+
+
+def find_duplicates(
+    database_name: str,
+    threshold: float = DEFAULT_THRESHOLD,
+    workers: int = None,
+    max_block_size: int = DEFAULT_MAX_BLOCK_SIZE,
+) -> dict:
+    """Finds candidate duplicate memorials and writes them to the duplicates table.
+
+    Memorials are grouped into blocks by blocking_keys(), and only memorials in
+    the same block are compared, so the work grows with the number of
+    memorials rather than its square. The keys are written to a temporary
+    table and read back in key order, so only one block at a time is held in
+    memory, and blocks are scored in parallel on a process pool. Blocks larger
+    than max_block_size are skipped, as a key shared by that many memorials is
+    too common to be useful.
+
+    Args:
+        database_name (str): the database to search
+        threshold (float): minimum score of a candidate pair, between 0 and 1
+        workers (int): number of processes; defaults to the number of CPUs
+        max_block_size (int): largest block that will be compared
+
+    Returns:
+        dict: the number of "blocks" compared, "skipped" and "pairs" found
+    """
+    create_table(database_name)
+    # blocks are read on the pool's task handler thread
+    reader = sqlite3.connect(database_name, check_same_thread=False)
+    _load_blocks(reader)
+    skipped = set()
+    for key, size in reader.execute(
+        "SELECT key, count(*) FROM temp.blocks GROUP BY key HAVING count(*) > ?",
+        (max_block_size,),
+    ):
+        log.warning("Skipping block %s of %d memorials", key, size)
+        skipped.add(key)
+
+    counts = {"blocks": 0, "skipped": len(skipped), "pairs": 0}
+    conn = sqlite3.connect(database_name)
+    with conn, Pool(workers or os.cpu_count()) as pool:
+        conn.execute("DELETE FROM duplicates")
+        work = _iter_blocks(reader, threshold, skipped)
+        for result in pool.imap_unordered(score_block, work, chunksize=16):
+            counts["blocks"] += 1
+            counts["pairs"] += len(result)
+            conn.executemany(
+                "INSERT INTO duplicates (id_a, id_b, score) VALUES (?, ?, ?)", result
+            )
+    conn.close()
+    reader.close()
+    return counts
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class FamilyLink:
+    """Class for keeping track of a family link between two memorials."""
+
+    memorial_id: int
+    relative_id: int
+    relationship: str
+
+    @classmethod
+    def from_dict(cls, d):
+        return FamilyLink(**d)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def create_table(cls, database_name="graves.db"):
+        conn = sqlite3.connect(database_name)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS family
+            (memorial_id INTEGER, relative_id INTEGER, relationship TEXT,
+            PRIMARY KEY (memorial_id, relative_id, relationship))"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS family_relative_id ON family (relative_id)"
+        )
+        conn.close()
+
+    @classmethod
+    def get_by_memorial_id(cls, memorial_id: int) -> list:
+        con = sqlite3.connect(os.getenv("DATABASE_NAME", "graves.db"))
+        cur = con.execute(
+            "SELECT memorial_id, relative_id, relationship FROM family "
+            + "WHERE memorial_id=?",
+            (memorial_id,),
+        )
+        links = [FamilyLink(*record) for record in cur.fetchall()]
+        con.close()
+        return links
+
+    @classmethod
+    def save_family(cls, memorial_id: int, links: list):
+        """Replaces the family links of memorial_id with links"""
+        with sqlite3.connect(os.getenv("DATABASE_NAME", "graves.db")) as con:
+            con.execute("DELETE FROM family WHERE memorial_id=?", (memorial_id,))
+            con.executemany(
+                "INSERT OR IGNORE INTO family (memorial_id,relative_id,relationship)"
+                + " VALUES (?, ?, ?)",
+                [(memorial_id, link.relative_id, link.relationship) for link in links],
+            )
+            con.commit()
@@ -0,0 +1,356 @@
+import logging as log
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.client import HTTPResponse
+from typing import Optional
+from urllib.error import HTTPError
+from urllib.request import ProxyHandler, Request, build_opener, urlopen
+
+DEFAULT_USER_AGENT = "Mozilla/5.0"
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_BUDGET = 0.05
+DEFAULT_LATENCY_WINDOW = 1000
+DEFAULT_PROXY_RATE = 1.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+# HTTP statuses that mean an egress point is being throttled or is broken
+PROXY_FAILURE_STATUSES = {407, 429, 502, 503, 504}
+
+
+class LatencyTracker(object):
+    """Keeps a sliding window of recent latencies, in seconds."""
+
+    def __init__(self, window: int = DEFAULT_LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Returns the nearest-rank percentile of the window, or None if empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) == 0:
+            return None
+        rank = max(int(round(pct / 100.0 * len(samples))), 1)
+        return samples[min(rank, len(samples)) - 1]
+
+
+class Proxy(object):
+    """An HTTP proxy with its own rate budget, health and circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and the
+    proxy is not used for cooldown seconds. It then gets a single trial
+    request: success closes the circuit, failure opens it again.
+
+    Args:
+        url (str): the proxy, e.g. "http://10.0.0.1:3128"
+        rate (float): maximum requests per second through this proxy
+        failure_threshold (int): consecutive failures that open the circuit
+        cooldown (float): seconds the circuit stays open
+    """
+
+    def __init__(
+        self,
+        url: str,
+        rate: float = DEFAULT_PROXY_RATE,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = DEFAULT_COOLDOWN,
+    ):
+        self.url = url
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.opener = build_opener(ProxyHandler({"http": url, "https": url})).open
+        self.latency = LatencyTracker()
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.next_slot = 0.0
+        self.open_until = 0.0
+
+    def __repr__(self):
+        return "Proxy({})".format(self.url)
+
+    def is_open(self, now: float) -> bool:
+        """True if the circuit is open and the proxy must not be used"""
+        if self.consecutive_failures < self.failure_threshold:
+            return False
+        # half-open: one trial request at a time once the cooldown is over
+        return now < self.open_until or self.in_flight > 0
+
+
+class ProxyPool(object):
+    """Spreads requests across proxies by least load, within each rate budget"""
+
+    def __init__(self, proxies: list):
+        if len(proxies) == 0:
+            raise ValueError("A ProxyPool needs at least one proxy")
+        self.proxies = proxies
+        self._condition = threading.Condition()
+
+    def acquire(self) -> Proxy:
+        """Returns the least loaded healthy proxy once it has a request slot"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                proxy, slot = self._reserve(now)
+                if proxy is not None:
+                    break
+                # every circuit is open; wait for the first cooldown to end
+                reopen = min(p.open_until for p in self.proxies)
+                self._condition.wait(timeout=max(reopen - now, 0.01))
+        if slot > now:
+            time.sleep(slot - now)
+        return proxy
+
+    def reserve(self, exclude: Proxy = None):
+        """Reserves a request slot without waiting for it or for a cooldown.
+
+        Returns:
+            tuple: the least loaded healthy proxy other than exclude and the
+            time.monotonic() of its slot, or (None, None) if there is none
+        """
+        with self._condition:
+            return self._reserve(time.monotonic(), exclude)
+
+    def _reserve(self, now: float, exclude: Proxy = None):
+        healthy = [p for p in self.proxies if not p.is_open(now) and p is not exclude]
+        if not healthy:
+            return None, None
+        proxy = min(healthy, key=lambda p: (p.in_flight, p.next_slot))
+        slot = max(proxy.next_slot, now)
+        proxy.next_slot = slot + proxy.min_interval
+        proxy.in_flight += 1
+        return proxy, slot
+
+    def release(self, proxy: Proxy, ok: bool, latency: float = None):
+        with self._condition:
+            proxy.in_flight -= 1
+            if ok:
+                proxy.successes += 1
+                proxy.consecutive_failures = 0
+                if latency is not None:
+                    proxy.latency.add(latency)
+            else:
+                proxy.failures += 1
+                proxy.consecutive_failures += 1
+                if proxy.consecutive_failures >= proxy.failure_threshold:
+                    proxy.open_until = time.monotonic() + proxy.cooldown
+            self._condition.notify_all()
+
+    @classmethod
+    def from_urls(cls, urls: list, rate: float = DEFAULT_PROXY_RATE):
+        return ProxyPool([Proxy(url, rate) for url in urls])
+
+
+class Fetcher(object):
+    """Fetches pages with bounded connect/read timeouts and optional hedging.
+
+    When hedging is enabled, a request that is still outstanding after the
+    running p95 latency triggers a duplicate request, and whichever response
+    arrives first wins. The number of duplicates is capped at ``hedge_budget``
+    (a fraction of all requests) so hedging never doubles the load we put on
+    the site. When a ProxyPool is given, every request, hedged or not, goes
+    through one of its proxies and counts against that proxy's rate budget.
+    The hedge timer starts once the primary has its proxy slot, and the
+    duplicate goes through a different proxy.
+
+    Args:
+        connect_timeout (float): seconds to wait for the connection and headers
+        read_timeout (float): seconds to wait on each read of the response body
+        hedge (bool): enable hedged requests
+        hedge_budget (float): maximum fraction of requests that may be hedged
+        hedge_min_samples (int): latencies to observe before hedging kicks in
+        opener: callable with the signature of ``urllib.request.urlopen``
+        proxies (ProxyPool): send requests through these proxies instead of
+            connecting directly with opener
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        hedge: bool = False,
+        hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+        hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+        opener=urlopen,
+        proxies: ProxyPool = None,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self.opener = opener
+        self.proxies = proxies
+        # latency of individual HTTP requests, used for the hedge threshold
+        self.latency = LatencyTracker()
+        # end-to-end latency of each fetch() call, i.e. what the caller sees
+        self.page_latency = LatencyTracker()
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._read_timeout_warned = False
+
+    def fetch(self, url: str) -> bytes:
+        """Returns the body of the page at url"""
+        start = time.monotonic()
+        if self.hedge and len(self.latency) >= self.hedge_min_samples:
+            body = self._hedged_fetch(url)
+        else:
+            body = self._timed_fetch(url)
+        self.page_latency.add(time.monotonic() - start)
+        return body
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _timed_fetch(self, url: str, proxy: Proxy = None) -> bytes:
+        with self._lock:
+            self.requests += 1
+        if self.proxies is not None:
+            return self._proxied_fetch(url, proxy or self.proxies.acquire())
+        start = time.monotonic()
+        body = self._open(self.opener, url)
+        self.latency.add(time.monotonic() - start)
+        return body
+
+    def _proxied_fetch(self, url: str, proxy: Proxy) -> bytes:
+        start = time.monotonic()
+        try:
+            body = self._open(proxy.opener, url)
+        except HTTPError as ex:
+            # most HTTP errors are about the page, not the egress point
+            ok = ex.code not in PROXY_FAILURE_STATUSES
+            self.proxies.release(proxy, ok)
+            raise
+        except Exception:
+            self.proxies.release(proxy, False)
+            raise
+        latency = time.monotonic() - start
+        self.proxies.release(proxy, True, latency)
+        self.latency.add(latency)
+        return body
+
+    @contextmanager
+    def open(self, url: str):
+        """Opens url for streaming and yields the response.
+
+        Like fetch(), the request is subject to the timeouts and goes through
+        the proxy pool if there is one, but it is never hedged and the body is
+        left for the caller to read.
+        """
+        with self._lock:
+            self.requests += 1
+        proxy = self.proxies.acquire() if self.proxies is not None else None
+        ok = True
+        try:
+            with self._urlopen(proxy.opener if proxy else self.opener, url) as response:
+                yield response
+        except HTTPError as ex:
+            ok = ex.code not in PROXY_FAILURE_STATUSES
+            raise
+        except OSError:
+            # connection errors and timeouts, as opposed to errors of the caller
+            ok = False
+            raise
+        finally:
+            if proxy is not None:
+                self.proxies.release(proxy, ok)
+
+    def _urlopen(self, opener, url: str):
+        req = Request(url, headers={"User-Agent": DEFAULT_USER_AGENT})
+        response = opener(req, timeout=self.connect_timeout)
+        self._set_read_timeout(response)
+        return response
+
+    def _open(self, opener, url: str) -> bytes:
+        with self._urlopen(opener, url) as response:
+            return response.read()
+
+    def _set_read_timeout(self, response):
+        # urlopen applies a single timeout to connect and read; once the headers
+        # are in, switch the underlying socket over to the read timeout
+        raw = getattr(getattr(response, "fp", None), "raw", None)
+        sock = getattr(raw, "_sock", None)
+        if sock is not None:
+            sock.settimeout(self.read_timeout)
+        elif isinstance(response, HTTPResponse) and not self._read_timeout_warned:
+            # file:// and stand-in responses have no socket; an HTTP one should
+            self._read_timeout_warned = True
+            log.warning(
+                "Cannot find the response socket; body reads use the "
+                "connect timeout (%ss) instead of the read timeout",
+                self.connect_timeout,
+            )
+
+    def _acquire_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.hedge_budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _hedged_fetch(self, url: str) -> bytes:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="graver-hedge")
+        threshold = self.latency.percentile(DEFAULT_HEDGE_PERCENTILE)
+        # wait for the proxy's rate limit before starting the hedge timer, so
+        # that time spent queueing for a slot doesn't look like a slow response
+        proxy = self.proxies.acquire() if self.proxies is not None else None
+        primary = self._executor.submit(self._timed_fetch, url, proxy)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+        duplicate = self._submit_duplicate(url, proxy)
+        if duplicate is None:
+            return primary.result()
+
+        pending = {primary, duplicate}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _submit_duplicate(self, url: str, proxy: Proxy):
+        """Submits a duplicate of a slow request, if the budget allows.
+
+        With a proxy pool, the duplicate goes through a different healthy
+        proxy than the primary, or isn't sent at all.
+        """
+        if not self._acquire_hedge():
+            return None
+        if proxy is None:
+            return self._executor.submit(self._timed_fetch, url)
+        other, slot = self.proxies.reserve(exclude=proxy)
+        if other is None:
+            with self._lock:
+                self.hedges -= 1
+            return None
+        return self._executor.submit(self._delayed_fetch, url, other, slot)
+
+    def _delayed_fetch(self, url: str, proxy: Proxy, slot: float) -> bytes:
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self._timed_fetch(url, proxy)
@@ -67,7 +67,10 @@ class Memorial:
         con.row_factory = sqlite3.Row
 
         cur = con.cursor()
-        cur.execute("SELECT * FROM graves WHERE id=?", (grave_id,))
+        cur.execute(
+            "SELECT {} FROM graves WHERE id=?".format(",".join(cls.COLUMNS)),
+            (grave_id,),
+        )
 
         record = cur.fetchone()
 
@@ -87,16 +90,21 @@ class Memorial:
             """CREATE TABLE IF NOT EXISTS graves
             (id INTEGER PRIMARY KEY, url TEXT,
             name TEXT, birth TEXT, birthplace TEXT, death TEXT, deathplace TEXT,
-            burial TEXT, plot TEXT, coords TEXT, more_info BOOL)"""
+            burial TEXT, plot TEXT, coords TEXT, more_info BOOL, fetched TIMESTAMP)"""
         )
+        # databases created before the fetched column existed
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(graves)")]
+        if "fetched" not in columns:
+            conn.execute("ALTER TABLE graves ADD COLUMN fetched TIMESTAMP")
         conn.close()
 
     def save(self) -> "Memorial":
         with sqlite3.connect(os.getenv("DATABASE_NAME", "graves.db")) as con:
             con.cursor().execute(
                 "INSERT OR REPLACE INTO graves (id,url,name,birth,birthplace,death,"
-                + "deathplace,burial,plot,coords,more_info) VALUES"
-                + "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                + "deathplace,burial,plot,coords,more_info,fetched) VALUES"
+                + "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                + "strftime('%Y-%m-%d %H:%M:%f', 'now'))",
                 (
                     self.id,
                     self.url,
@@ -1,18 +1,20 @@
 import re
 from urllib.parse import parse_qsl, urlparse
-from urllib.request import Request, urlopen
 
 from bs4 import BeautifulSoup
 
 from graver.cemetery import Cemetery
+from graver.family import FamilyLink
+from graver.fetcher import Fetcher
 from graver.memorial import Memorial, MemorialMergedException
 
 
 class Parser(object):
-    def __init__(self, url, name, search_url):
+    def __init__(self, url, name, search_url, fetcher: Fetcher = None):
         self.url = url
         self.name = name
         self.search_url = search_url
+        self.fetcher = fetcher if fetcher is not None else Fetcher()
 
     @staticmethod
     def parse_canonical_link(soup):
@@ -25,11 +27,24 @@ class MemorialParser(Parser):
     PAGE_URL = "http://www.findagrave.com/memorial"
     NAME = "Memorial Search"
     SEARCH_URL = "search?"
-
-    def __init__(self):
+    # aria-labelledby ids of the family lists on a memorial page
+    FAMILY_LABELS = {
+        "parentsLabel": "parent",
+        "spouseLabel": "spouse",
+        "siblingsLabel": "sibling",
+        "halfSiblingsLabel": "half-sibling",
+        "childrenLabel": "child",
+    }
+
+    def __init__(self, fetcher: Fetcher = None):
         super().__init__(
-            MemorialParser.PAGE_URL, MemorialParser.NAME, MemorialParser.SEARCH_URL
+            MemorialParser.PAGE_URL,
+            MemorialParser.NAME,
+            MemorialParser.SEARCH_URL,
+            fetcher,
         )
+        # family links of the most recently parsed memorial
+        self.family = []
 
     @staticmethod
     def check_merged(soup: BeautifulSoup):
@@ -132,10 +147,23 @@ class MemorialParser(Parser):
     def parse_more_info(soup):
         return False
 
+    @staticmethod
+    def parse_family(soup, memorial_id: int):
+        """Returns a list of FamilyLinks to the relatives listed on the page"""
+        links = []
+        for label, relationship in MemorialParser.FAMILY_LABELS.items():
+            for ul in soup.find_all("ul", attrs={"aria-labelledby": label}):
+                for anchor in ul.find_all("a", href=re.compile("/memorial/[0-9]+")):
+                    href = anchor["href"]
+                    relative_id = int(re.match(".*/memorial/([0-9]+)", href).group(1))
+                    link = FamilyLink(memorial_id, relative_id, relationship)
+                    if relative_id != memorial_id and link not in links:
+                        links.append(link)
+        return links
+
     def parse(self, url):
-        req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-        with urlopen(req) as response:
-            soup = BeautifulSoup(response.read(), "lxml")
+        self.family = []
+        soup = BeautifulSoup(self.fetcher.fetch(url), "lxml")
 
         merged, newurl = self.check_merged(soup)
         if merged:
@@ -153,6 +181,7 @@ class MemorialParser(Parser):
         plot = MemorialParser.parse_burial_plot(soup)
         coords = MemorialParser.parse_coords(soup)
         more_info = MemorialParser.parse_more_info(soup)
+        self.family = MemorialParser.parse_family(soup, id)
         return Memorial(
             id,
             url,
@@ -169,13 +198,17 @@ class MemorialParser(Parser):
 
 
 class CemeteryParser(Parser):
+    DEFAULT_URL_FORMAT = "https://www.findagrave.com/cemetery/{}"
     PAGE_URL = "http://www.findagrave.com/cemetery"
     NAME = "Cemetery Search"
     SEARCH_URL = "search?"
 
-    def __init__(self):
+    def __init__(self, fetcher: Fetcher = None):
         super().__init__(
-            CemeteryParser.PAGE_URL, CemeteryParser.NAME, CemeteryParser.SEARCH_URL
+            CemeteryParser.PAGE_URL,
+            CemeteryParser.NAME,
+            CemeteryParser.SEARCH_URL,
+            fetcher,
         )
 
     @staticmethod
@@ -220,9 +253,7 @@ class CemeteryParser(Parser):
             "https://www.findagrave.com/cemetery/12345/"
         """
 
-        req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-        with urlopen(req) as response:
-            soup = BeautifulSoup(response.read(), "lxml")
+        soup = BeautifulSoup(self.fetcher.fetch(url), "lxml")
 
         url = CemeteryParser.parse_canonical_link(soup)
         id = re.match("https://www.findagrave.com/cemetery/([0-9]+)/.*", url).group(1)
@@ -230,3 +261,22 @@ class CemeteryParser(Parser):
         location = CemeteryParser.parse_location(soup)
         coords = CemeteryParser.parse_coords(soup)
         return Cemetery(int(id), url, name, location, coords)
+
+
+def get_id_from_url(url: str):
+    result = None
+    old_style = ".*?GRid=([0-9]+)/?$"
+    new_style = MemorialParser.DEFAULT_URL_FORMAT.format("([0-9]+)/?")
+    if re.match(old_style, url):  # oldstyle URL format
+        result = int(re.match(old_style, url).group(1))
+    elif re.match(new_style, url):
+        result = int(re.match(new_style, url).group(1))
+    return result
+
+
+def get_cemetery_id_from_url(url: str):
+    result = None
+    match = re.match(CemeteryParser.DEFAULT_URL_FORMAT.format("([0-9]+)/?"), url)
+    if match is not None:
+        result = int(match.group(1))
+    return result
@@ -0,0 +1,91 @@
+import gzip
+import io
+import re
+from contextlib import ExitStack, contextmanager
+
+from lxml import etree
+
+from graver.fetcher import Fetcher
+from graver.parsers import get_cemetery_id_from_url, get_id_from_url
+
+GZIP_MAGIC = b"\x1f\x8b"
+KINDS = ["memorial", "cemetery"]
+
+
+@contextmanager
+def open_sitemap(location: str, fetcher: Fetcher = None):
+    """Opens a sitemap URL or file as a binary stream, decompressing gzip data.
+
+    URLs are opened with fetcher, so they get its timeouts and proxies.
+    """
+    with ExitStack() as stack:
+        if re.match("^https?://", location):
+            fetcher = fetcher if fetcher is not None else Fetcher()
+            raw = stack.enter_context(fetcher.open(location))
+        else:
+            raw = stack.enter_context(open(location, "rb"))
+        stream = raw if hasattr(raw, "peek") else io.BufferedReader(raw)
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=stream)
+        yield stream
+
+
+def iter_locations(stream):
+    """Yields ("sitemap" or "url", location) for each entry of a sitemap.
+
+    Elements are cleared as soon as they have been read, so memory use does
+    not grow with the size of the sitemap.
+    """
+    # sitemaps come from the network; never expand entities or fetch DTDs
+    for _, elem in etree.iterparse(
+        stream,
+        events=("end",),
+        tag=("{*}sitemap", "{*}url"),
+        resolve_entities=False,
+        no_network=True,
+    ):
+        loc = elem.findtext("{*}loc")
+        kind = etree.QName(elem).localname
+        elem.clear()
+        # drop the references the root keeps to entries already processed
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+        if loc is not None:
+            yield kind, loc.strip()
+
+
+def discover(
+    locations: list, kinds: list = None, visited: set = None, fetcher: Fetcher = None
+):
+    """Yields (kind, id) for each memorial or cemetery found in the sitemaps.
+
+    Each sitemap index is read in full and closed before the sitemaps it
+    lists are read, in order. Each sitemap is read at most once.
+
+    Args:
+        locations (list): sitemap or sitemap index URLs or file names
+        kinds (list): any of "memorial" and "cemetery"; defaults to both
+        visited (set): sitemaps already read
+        fetcher (Fetcher): used to open sitemap URLs
+    """
+    kinds = KINDS if kinds is None else kinds
+    visited = set() if visited is None else visited
+    for location in locations:
+        if location in visited:
+            continue
+        visited.add(location)
+        children = []
+        with open_sitemap(location, fetcher) as stream:
+            for entry, loc in iter_locations(stream):
+                if entry == "sitemap":
+                    # only a URL each; read the whole index before the
+                    # children, rather than hold its connection open
+                    children.append(loc)
+                    continue
+                memorial_id = get_id_from_url(loc)
+                if memorial_id is not None and "memorial" in kinds:
+                    yield "memorial", memorial_id
+                cemetery_id = get_cemetery_id_from_url(loc)
+                if cemetery_id is not None and "cemetery" in kinds:
+                    yield "cemetery", cemetery_id
+        yield from discover(children, kinds, visited, fetcher)
@@ -0,0 +1,160 @@
+import sqlite3
+from contextlib import contextmanager
+
+# SQL expression for the decade of a date such as "9 Sep 1941" or "1941"
+DECADE = (
+    "CASE WHEN substr(trim({column}), -4) GLOB '[0-9][0-9][0-9][0-9]' "
+    + "THEN substr(trim({column}), -4, 3) || '0s' ELSE '' END"
+)
+
+# Each dimension maps to the SQL expression of its key for a graves row {row}
+DIMENSIONS = {
+    "total": "''",
+    "cemetery": "coalesce({row}.burial, '')",
+    "birth_decade": DECADE.format(column="{row}.birth"),
+    "death_decade": DECADE.format(column="{row}.death"),
+    "cemetery_decade": "coalesce({row}.burial, '') || '|' || "
+    + DECADE.format(column="{row}.death"),
+    "birthplace": "coalesce({row}.birthplace, '')",
+    "deathplace": "coalesce({row}.deathplace, '')",
+    "coords": "CASE WHEN coalesce({row}.coords, '') = '' THEN 'no' ELSE 'yes' END",
+}
+
+# the graves columns the dimensions are computed from
+COLUMNS = ["birth", "birthplace", "death", "deathplace", "burial", "coords"]
+
+TRIGGERS = [
+    "graves_stats_replace",
+    "graves_stats_insert",
+    "graves_stats_delete",
+    "graves_stats_update",
+]
+
+
+def _increment(row: str) -> str:
+    return "".join(
+        f"""INSERT INTO stats (dimension, key, count)
+        VALUES ('{dimension}', {key.format(row=row)}, 1)
+        ON CONFLICT (dimension, key) DO UPDATE SET count = count + 1;
+        """
+        for dimension, key in DIMENSIONS.items()
+    )
+
+
+def _decrement(row: str, where: str = None, table: str = "graves") -> str:
+    statements = ""
+    for dimension, key in DIMENSIONS.items():
+        key = key.format(row=row)
+        if where is not None:
+            key = f"(SELECT {key} FROM {table} AS {row} WHERE {where})"
+        statements += f"""UPDATE stats SET count = count - 1
+        WHERE dimension = '{dimension}' AND key = {key};
+        """
+    return statements + "DELETE FROM stats WHERE count <= 0 AND dimension != 'total';"
+
+
+def create_triggers(conn: sqlite3.Connection):
+    # INSERT OR REPLACE deletes the old row without firing delete triggers
+    # (unless recursive_triggers is on). A BEFORE INSERT trigger cannot tell
+    # whether the insert will replace the row, be ignored (INSERT OR IGNORE) or
+    # become an UPDATE (upsert), so it only sets aside a copy of the existing
+    # row, and the AFTER INSERT trigger, which fires only if a row was really
+    # inserted, retracts the stats of that copy.
+    columns = ", ".join(COLUMNS)
+    conn.executescript(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS graves_stats_replace BEFORE INSERT ON graves
+        BEGIN
+        DELETE FROM stats_replaced WHERE id = NEW.id;
+        INSERT INTO stats_replaced (id, {columns})
+        SELECT id, {columns} FROM graves WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS graves_stats_insert AFTER INSERT ON graves
+        BEGIN
+        {_decrement("old_row", "old_row.id = NEW.id", "stats_replaced")}
+        DELETE FROM stats_replaced WHERE id = NEW.id;
+        {_increment("NEW")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS graves_stats_delete AFTER DELETE ON graves
+        BEGIN {_decrement("OLD")} END;
+        CREATE TRIGGER IF NOT EXISTS graves_stats_update AFTER UPDATE ON graves
+        BEGIN
+        {_decrement("OLD")} {_increment("NEW")}
+        DELETE FROM stats_replaced WHERE id = NEW.id;
+        END;
+        """
+    )
+
+
+def drop_triggers(conn: sqlite3.Connection):
+    for trigger in TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def rebuild(conn: sqlite3.Connection):
+    """Recomputes every statistic from the graves table in one transaction"""
+    selects = " UNION ALL ".join(
+        f"SELECT '{dimension}', {key.format(row='g')}, count(*) FROM graves AS g "
+        + "GROUP BY 2"
+        for dimension, key in DIMENSIONS.items()
+    )
+    # a savepoint works the same whatever the connection's isolation_level
+    conn.execute("SAVEPOINT stats_rebuild")
+    try:
+        conn.execute("DELETE FROM stats")
+        conn.execute("DELETE FROM stats_replaced")
+        conn.execute(f"INSERT INTO stats (dimension, key, count) {selects}")
+        # an empty graves table still has a total
+        conn.execute("INSERT OR IGNORE INTO stats VALUES ('total', '', 0)")
+        conn.execute("RELEASE stats_rebuild")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK TO stats_rebuild")
+        conn.execute("RELEASE stats_rebuild")
+        raise
+
+
+@contextmanager
+def deferred(conn: sqlite3.Connection):
+    """Suspends incremental maintenance for a bulk load, then rebuilds"""
+    drop_triggers(conn)
+    try:
+        yield
+    finally:
+        rebuild(conn)
+        create_triggers(conn)
+
+
+def create_table(database_name="graves.db"):
+    conn = sqlite3.connect(database_name)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS stats
+        (dimension TEXT, key TEXT, count INTEGER, PRIMARY KEY (dimension, key))"""
+    )
+    # rows an INSERT is about to replace; see create_triggers
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS stats_replaced (id INTEGER PRIMARY KEY, "
+        + ", ".join(f"{column} TEXT" for column in COLUMNS)
+        + ")"
+    )
+    installed = conn.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type='trigger' AND name IN "
+        + "({})".format(",".join("?" * len(TRIGGERS))),
+        TRIGGERS,
+    ).fetchone()[0]
+    if installed < len(TRIGGERS):
+        # catch up with any rows written before the triggers existed
+        rebuild(conn)
+        create_triggers(conn)
+    conn.close()
+
+
+def get_stats(conn: sqlite3.Connection, dimension: str, limit: int = None) -> list:
+    """Returns (key, count) pairs for dimension, largest counts first"""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension {dimension}")
+    cur = conn.execute(
+        "SELECT key, count FROM stats WHERE dimension=? "
+        + "ORDER BY count DESC, key LIMIT ?",
+        (dimension, -1 if limit is None else limit),
+    )
+    return cur.fetchall()
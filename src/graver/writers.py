@@ -0,0 +1,122 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import threading
+
+from graver.memorial import Memorial
+
+OUTPUT_FORMATS = ["jsonl", "csv"]
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class MemorialWriter(object):
+    """Streams memorials to a file or stdout, one per line, as JSONL or CSV.
+
+    Output is buffered, but a background thread flushes it every
+    flush_interval seconds while there is unflushed data, so that a consumer
+    at the other end of a pipe sees memorials soon after they are scraped,
+    even when scraping stalls.
+
+    Args:
+        filename (str): the file to write, or "-" for stdout
+        output_format (str): "jsonl" or "csv"
+        compress (bool): gzip the output; defaults to True for .gz files
+        flush_interval (float): seconds between background flushes
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        output_format: str,
+        compress: bool = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}")
+        if compress is None:
+            compress = filename.endswith(".gz")
+        self.output_format = output_format
+        self.flush_interval = flush_interval
+        self.count = 0
+        # guards the streams below, which the flush thread also uses
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._error = None
+        self._closed = threading.Event()
+
+        if filename == "-":
+            self._raw = None
+            binary = sys.stdout.buffer
+        else:
+            self._raw = open(filename, "wb", buffering=DEFAULT_BUFFER_SIZE)
+            binary = self._raw
+        self._gzip = gzip.GzipFile(fileobj=binary, mode="wb") if compress else None
+        self._file = io.TextIOWrapper(
+            self._gzip if compress else binary,
+            encoding="utf-8",
+            newline="",
+            write_through=False,
+        )
+        if output_format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=Memorial.COLUMNS)
+            self._csv.writeheader()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="graver-flush", daemon=True
+        )
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, memorial: Memorial):
+        with self._lock:
+            if self._error is not None:
+                # the background flush failed, e.g. on a full disk
+                raise self._error
+            if self.output_format == "csv":
+                self._csv.writerow(memorial.to_dict())
+            else:
+                self._file.write(json.dumps(memorial.to_dict()) + "\n")
+            self.count += 1
+            self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        if self._gzip is not None:
+            # emit a complete deflate block so the consumer can decode it
+            self._gzip.flush()
+        self._dirty = False
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                try:
+                    if self._dirty:
+                        self._flush()
+                except OSError as ex:
+                    # e.g. a closed pipe; the next write() raises it
+                    self._error = ex
+                    return
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        self._file.flush()
+        # don't close stdout along with the wrapper around it
+        self._file.detach()
+        if self._gzip is not None:
+            self._gzip.close()
+        if self._raw is not None:
+            self._raw.close()
+        else:
+            sys.stdout.buffer.flush()
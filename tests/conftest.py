@@ -3,8 +3,11 @@ import pathlib
 import tempfile
 
 import pytest
+from typer.testing import CliRunner
 
+import graver.memorial
 from src.graver.cemetery import Cemetery
+from src.graver.family import FamilyLink
 from src.graver.memorial import Memorial
 
 pytest_plugins = ["helpers_namespace"]
@@ -15,6 +18,38 @@ def to_uri(abs_path: str):
     return pathlib.Path(abs_path).as_uri()
 
 
+@pytest.helpers.register
+def make_memorial(
+    id: int,
+    name: str = None,
+    birth: str = "1 Jan 1900",
+    death: str = "1 Jan 1980",
+    burial: str = "3136",
+    coords: str = None,
+):
+    """Returns an unsaved Memorial, named "Person <id>" by default"""
+    # graver.memorial, not src.graver.memorial, so that results compare equal
+    # to the Memorials the tests read back from the database
+    return graver.memorial.Memorial(
+        id,
+        f"https://www.findagrave.com/memorial/{id}",
+        name if name is not None else f"Person {id}",
+        birth,
+        None,
+        death,
+        None,
+        burial,
+        None,
+        coords,
+        False,
+    )
+
+
+@pytest.fixture
+def runner():
+    return CliRunner()
+
+
 @pytest.fixture(autouse=True)
 def database():
     """Creates an empty graver database as a tempfile"""
@@ -22,6 +57,7 @@ def database():
     os.environ["DATABASE_NAME"] = file_name
     Memorial.create_table(database_name=file_name)
     Cemetery.create_table(database_name=file_name)
+    FamilyLink.create_table(database_name=file_name)
     yield
     os.unlink(file_name)
 
@@ -1,10 +1,17 @@
+import csv
+import gzip
 import importlib.metadata
+import json
+import time
+import zlib
 
 import pytest
 from typer.testing import CliRunner
 
 import graver.cli as cli
 from graver.cli import app
+from graver.memorial import Memorial, NotFound
+from graver.writers import MemorialWriter
 
 runner = CliRunner()
 
@@ -28,3 +35,120 @@ def test_version():
 def test_get_id_from_url(expected_id: int, url: str):
     id = cli.get_id_from_url(url)
     assert id == expected_id
+
+
+@pytest.fixture
+def memorial_pages(tmp_path):
+    """Writes two memorial pages and a scrape input file listing them"""
+    uris = []
+    for id, name in [(534, "Andrew Jackson"), (1075, "George Washington")]:
+        page = tmp_path / f"{id}.html"
+        page.write_text(
+            f"""<html><head><link rel="canonical"
+            href="https://www.findagrave.com/memorial/{id}/x"></head>
+            <body><h1 id="bio-name">{name}</h1>
+            <time itemprop="birthDate">15 Mar 1767</time></body></html>"""
+        )
+        uris.append(page.as_uri())
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("\n".join(uris))
+    return str(input_file)
+
+
+def test_scrape_output_jsonl_to_stdout(memorial_pages):
+    result = CliRunner(mix_stderr=False).invoke(
+        app, ["scrape", memorial_pages, "--output", "jsonl"]
+    )
+    assert result.exit_code == 0
+    lines = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(m["id"], m["name"]) for m in lines] == [
+        (534, "Andrew Jackson"),
+        (1075, "George Washington"),
+    ]
+    assert "Successfully parsed 2 of 2" in result.stderr
+    with pytest.raises(NotFound):
+        Memorial.get_by_id(534)
+
+
+def test_scrape_stdin_skips_duplicates(memorial_pages):
+    with open(memorial_pages) as f:
+        uris = f.read().splitlines()
+    result = CliRunner(mix_stderr=False).invoke(
+        app,
+        ["scrape", "-", "--output", "jsonl"],
+        input="\n".join([uris[0], uris[0], "", uris[1]]) + "\n",
+    )
+    assert result.exit_code == 0
+    assert len(result.stdout.splitlines()) == 2
+    assert "Successfully parsed 2 of 2" in result.stderr
+
+
+def test_iter_urls_reads_lazily():
+    lines = ["534\n", "534\n", "https://www.findagrave.com/memorial/1075\n"]
+    read = []
+
+    class Stream(object):
+        def readline(self):
+            read.append(lines[len(read)] if len(read) < len(lines) else "")
+            return read[-1]
+
+    urls = cli.iter_urls(Stream())
+    assert next(urls) == "https://www.findagrave.com/memorial/534"
+    assert len(read) == 1
+    assert list(urls) == ["https://www.findagrave.com/memorial/1075"]
+
+
+def test_scrape_output_csv_gz(memorial_pages, tmp_path):
+    output_file = str(tmp_path / "graves.csv.gz")
+    result = runner.invoke(
+        app,
+        ["scrape", memorial_pages, "--output", "csv", "--output-file", output_file],
+    )
+    assert result.exit_code == 0
+    with gzip.open(output_file, "rt", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0].keys()) == Memorial.COLUMNS
+    assert [row["birth"] for row in rows] == ["15 Mar 1767", "15 Mar 1767"]
+
+
+def test_scrape_output_unknown_format(memorial_pages):
+    result = runner.invoke(app, ["scrape", memorial_pages, "--output", "xml"])
+    assert result.exit_code != 0
+
+
+@pytest.mark.parametrize("filename", ["graves.jsonl", "graves.jsonl.gz"])
+def test_writer_flushes_while_idle(tmp_path, filename):
+    output_file = tmp_path / filename
+    with MemorialWriter(str(output_file), "jsonl", flush_interval=0.1) as writer:
+        writer.write(pytest.helpers.make_memorial(534, "Andrew Jackson"))
+        time.sleep(0.5)
+        data = output_file.read_bytes()
+        if filename.endswith(".gz"):
+            data = zlib.decompressobj(wbits=31).decompress(data)
+        assert json.loads(data)["name"] == "Andrew Jackson"
+
+
+def test_writer_reports_failed_background_flush():
+    writer = MemorialWriter("/dev/full", "jsonl", flush_interval=0.05)
+    writer.write(pytest.helpers.make_memorial(534))
+    time.sleep(0.3)
+    with pytest.raises(OSError):
+        writer.write(pytest.helpers.make_memorial(1075))
+
+
+def test_scrape_stops_when_output_fails(memorial_pages):
+    result = CliRunner(mix_stderr=False).invoke(
+        app,
+        ["scrape", memorial_pages, "--output", "jsonl", "--output-file", "/dev/full"],
+    )
+    assert result.exit_code == 1
+    assert "Scrape stopped" in result.stderr
+    assert "Unable to parse" not in result.stderr
+
+
+def test_scrape_output_rejects_database(memorial_pages, tmp_path):
+    result = runner.invoke(
+        app, ["scrape", memorial_pages, str(tmp_path / "my.db"), "--output", "jsonl"]
+    )
+    assert result.exit_code == 2
+    assert not (tmp_path / "my.db").exists()
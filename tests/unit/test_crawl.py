@@ -0,0 +1,96 @@
+import re
+import threading
+
+import pytest
+
+from graver import database
+from graver.crawl import crawl_family, get_saved_ids
+from graver.family import FamilyLink
+from graver.memorial import Memorial
+
+# a small family tree: 1 and 2 are the parents of 3 and 4; 3 is the parent of 5
+# and 4 is the parent of 6, so 1 and 2 are shared ancestors of 5 and 6
+parents = {3: [1, 2], 4: [1, 2], 5: [3], 6: [4]}
+
+
+def memorial_page(memorial_id: int) -> bytes:
+    children = [child for child, ps in parents.items() if memorial_id in ps]
+    items = {
+        "parentsLabel": parents.get(memorial_id, []),
+        "childrenLabel": children,
+    }
+    lists = ""
+    for label, ids in items.items():
+        anchors = "".join(f'<li><a href="/memorial/{i}/x">{i}</a></li>' for i in ids)
+        lists += f'<ul aria-labelledby="{label}">{anchors}</ul>'
+    return f"""<html><head>
+    <link rel="canonical" href="https://www.findagrave.com/memorial/{memorial_id}/x">
+    </head><body><h1 id="bio-name">Person {memorial_id}</h1>{lists}</body></html>
+    """.encode()
+
+
+class FakeFetcher(object):
+    def __init__(self):
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def fetch(self, url: str) -> bytes:
+        with self.lock:
+            self.urls.append(url)
+        return memorial_page(int(re.match(".*/([0-9]+)$", url).group(1)))
+
+
+def test_crawl_family_visits_each_memorial_once():
+    fetcher = FakeFetcher()
+    counts = crawl_family(5, 4, fetcher, workers=3)
+    assert counts == {"fetched": 6, "skipped": 0, "failed": 0}
+    assert len(fetcher.urls) == len(set(fetcher.urls)) == 6
+    assert Memorial.get_by_id(6).name == "Person 6"
+    assert {f.relative_id for f in FamilyLink.get_by_memorial_id(3)} == {1, 2, 5}
+
+
+def test_crawl_family_depth_limit():
+    fetcher = FakeFetcher()
+    counts = crawl_family(5, 1, fetcher)
+    assert counts["fetched"] == 2
+    assert sorted(fetcher.urls) == [
+        "https://www.findagrave.com/memorial/3",
+        "https://www.findagrave.com/memorial/5",
+    ]
+
+
+def test_crawl_family_skips_saved_memorials():
+    crawl_family(3, 0, FakeFetcher())
+    fetcher = FakeFetcher()
+    counts = crawl_family(3, 1, fetcher)
+    assert counts == {"fetched": 3, "skipped": 1, "failed": 0}
+    assert "https://www.findagrave.com/memorial/3" not in fetcher.urls
+
+
+def test_crawl_family_refetches_saved_memorials_without_family():
+    # e.g. imported, or saved by a scrape that predates the family table
+    pytest.helpers.make_memorial(3, "Imported").save()
+    fetcher = FakeFetcher()
+    counts = crawl_family(3, 1, fetcher)
+    assert counts == {"fetched": 4, "skipped": 0, "failed": 0}
+    assert Memorial.get_by_id(3).name == "Person 3"
+    assert {f.relative_id for f in FamilyLink.get_by_memorial_id(3)} == {1, 2, 5}
+
+
+def test_get_saved_ids():
+    crawl_family(3, 0, FakeFetcher())
+    pytest.helpers.make_memorial(7).save()
+    assert get_saved_ids([3, 7, 8]) == {3: True, 7: False}
+    assert get_saved_ids(list(range(2000))) == {3: True, 7: False}
+
+
+def test_database_create_tables_includes_family(tmp_path):
+    db = str(tmp_path / "new.db")
+    database.create_tables(db)
+    conn = database.sqlite3.connect(db)
+    assert database.table_columns(conn, "family") == [
+        "memorial_id",
+        "relative_id",
+        "relationship",
+    ]
+    conn.close()
@@ -0,0 +1,184 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from graver import database, stats
+from graver.cli import app
+from graver.memorial import Memorial
+
+
+def make_shard(path, memorials: list, fetched: str = None, monkeypatch=None):
+    monkeypatch.setenv("DATABASE_NAME", str(path))
+    database.create_tables(str(path))
+    for memorial in memorials:
+        memorial.save()
+    conn = sqlite3.connect(path)
+    with conn:
+        if fetched is not None:
+            conn.execute("UPDATE graves SET fetched=?", (fetched,))
+        conn.execute(
+            "INSERT OR REPLACE INTO cemeteries (id, name) VALUES (3136, ?)",
+            (path.name,),
+        )
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    return [
+        make_shard(
+            tmp_path / "shard1.db",
+            [
+                pytest.helpers.make_memorial(1, "Old Name"),
+                pytest.helpers.make_memorial(2, "Two"),
+            ],
+            "2023-01-02 00:00:00.000",
+            monkeypatch,
+        ),
+        make_shard(
+            tmp_path / "shard2.db",
+            [
+                pytest.helpers.make_memorial(1, "Stale Name"),
+                pytest.helpers.make_memorial(3, "Three"),
+            ],
+            "2023-01-01 00:00:00.000",
+            monkeypatch,
+        ),
+    ]
+
+
+def test_merge_newest_fetch_wins(tmp_path, monkeypatch, shards):
+    out = str(tmp_path / "out.db")
+    counts = database.merge(out, shards)
+    assert counts == {"graves": 3, "cemeteries": 2, "family": 0}
+
+    monkeypatch.setenv("DATABASE_NAME", out)
+    assert Memorial.get_by_id(1).name == "Old Name"
+    assert Memorial.get_by_id(2).name == "Two"
+    assert Memorial.get_by_id(3).name == "Three"
+
+    conn = sqlite3.connect(out)
+    assert conn.execute("SELECT name FROM cemeteries").fetchall() == [("shard2.db",)]
+    conn.close()
+
+
+def test_merge_shard_without_fetched_column(tmp_path, monkeypatch, shards):
+    legacy = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(legacy)
+    conn.execute(
+        """CREATE TABLE graves (id INTEGER PRIMARY KEY, url TEXT, name TEXT,
+        birth TEXT, birthplace TEXT, death TEXT, deathplace TEXT, burial TEXT,
+        plot TEXT, coords TEXT, more_info BOOL)"""
+    )
+    conn.execute("INSERT INTO graves (id, name) VALUES (1, 'Legacy'), (4, 'Four')")
+    conn.commit()
+    conn.close()
+
+    out = str(tmp_path / "out.db")
+    counts = database.merge(out, shards + [legacy])
+    assert counts["graves"] == 4
+
+    monkeypatch.setenv("DATABASE_NAME", out)
+    assert Memorial.get_by_id(1).name == "Old Name"
+    assert Memorial.get_by_id(4).name == "Four"
+
+
+def test_cli_merge(tmp_path, shards, runner):
+    out = str(tmp_path / "out.db")
+    result = runner.invoke(app, ["merge", out] + shards)
+    assert result.exit_code == 0
+    assert "Merged 3 memorials and 2 cemeteries from 2 shards" in result.stdout
+
+
+def test_cli_merge_rejects_output_as_shard(tmp_path, shards, runner):
+    result = runner.invoke(app, ["merge", shards[0]] + shards)
+    assert result.exit_code != 0
+
+
+def test_bulk_connection_keeps_journal_for_existing_data(tmp_path, monkeypatch):
+    db = str(tmp_path / "graves.db")
+    database.create_tables(db)
+    conn = database.bulk_connection(db)
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("memory",)
+    conn.close()
+
+    monkeypatch.setenv("DATABASE_NAME", db)
+    pytest.helpers.make_memorial(1).save()
+    conn = database.bulk_connection(db)
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    assert conn.execute("PRAGMA synchronous").fetchone() == (1,)
+    conn.close()
+
+
+def test_bulk_import_csv(tmp_path, monkeypatch):
+    source = tmp_path / "graves.csv"
+    source.write_text(
+        ",".join(Memorial.COLUMNS)
+        + "\n"
+        + "1,https://www.findagrave.com/memorial/1,One,,,,,3136,,,0\n"
+        + "2,https://www.findagrave.com/memorial/2,Two,,,,,3136,,,1\n"
+        + "x,bad,Bad,,,,,,,,0\n"
+    )
+    out = str(tmp_path / "out.db")
+    database.create_tables(out)
+    conn = sqlite3.connect(out)
+    conn.execute("CREATE INDEX graves_name ON graves (name)")
+    conn.close()
+
+    counts = database.bulk_import(out, str(source), batch_size=1)
+    assert counts["imported"] == 2
+    assert counts["rejected"] == 1
+
+    monkeypatch.setenv("DATABASE_NAME", out)
+    memorial = Memorial.get_by_id(2)
+    assert memorial.name == "Two"
+    assert memorial.birth is None
+    assert memorial.more_info
+    conn = sqlite3.connect(out)
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    assert ("graves_name",) in indexes.fetchall()
+    assert stats.get_stats(conn, "total") == [("", 2)]
+    conn.close()
+
+
+def test_cli_import_jsonl_gz(tmp_path, monkeypatch, runner):
+    source = tmp_path / "graves.jsonl.gz"
+    with gzip.open(source, "wt") as f:
+        for n in range(1, 4):
+            f.write(
+                json.dumps(pytest.helpers.make_memorial(n, f"Person {n}").to_dict())
+                + "\n"
+            )
+        f.write("{not json\n")
+        f.write(json.dumps({"id": 9, "nickname": "Unknown column"}) + "\n")
+    out = str(tmp_path / "out.db")
+
+    result = runner.invoke(app, ["import", str(source), out])
+    assert result.exit_code == 0
+    assert "Imported 3 rows (2 rejected)" in result.stdout
+
+    monkeypatch.setenv("DATABASE_NAME", out)
+    assert Memorial.get_by_id(3) == pytest.helpers.make_memorial(3, "Person 3")
+
+
+@pytest.mark.parametrize("name, content", [("missing.csv", None), ("bad.csv.gz", b"x")])
+def test_cli_import_unreadable_file(tmp_path, runner, name, content):
+    source = tmp_path / name
+    if content is not None:
+        source.write_bytes(content)
+    out = str(tmp_path / "out.db")
+    database.create_tables(out)
+    conn = sqlite3.connect(out)
+    conn.execute("CREATE INDEX graves_name ON graves (name)")
+    conn.close()
+
+    result = runner.invoke(app, ["import", str(source), out])
+    assert result.exit_code == 2
+    assert "Unable to" in result.output
+    conn = sqlite3.connect(out)
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    assert ("graves_name",) in indexes.fetchall()
+    conn.close()
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+
+import pytest
+
+from graver import database, dedupe
+from graver.cli import app
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Robert", "R163"),
+        ("Rupert", "R163"),
+        ("Ashcraft", "A261"),
+        ("Tymczak", "T522"),
+        ("Pfister", "P236"),
+        ("Lee", "L000"),
+        ("", ""),
+    ],
+)
+def test_soundex(name, expected):
+    assert dedupe.soundex(name) == expected
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("John Smith Jr.", "smith"),
+        ("Dennis MacAlistair Ritchie", "ritchie"),
+        ("Andrew Jackson III", "jackson"),
+        (None, ""),
+    ],
+)
+def test_surname(name, expected):
+    assert dedupe.surname(name) == expected
+
+
+def test_cli_dedupe(runner):
+    database.create_tables(os.environ["DATABASE_NAME"])
+    for id, name, birth, death, burial in [
+        (1, "John Smith", "1 Jan 1900", "5 May 1970", "3136"),
+        (2, "Jon Smyth", "1900", "1970", "3136"),
+        (3, "John Smith", "1 Jan 1850", "5 May 1910", "153"),
+        (4, "Mary Jones", "1 Jan 1900", "5 May 1970", "3136"),
+        (5, "Nameless", None, None, None),
+    ]:
+        memorial = pytest.helpers.make_memorial(id, name, birth, death, burial)
+        memorial.save()
+
+    result = runner.invoke(app, ["dedupe", "--workers", "2"])
+    assert result.exit_code == 0
+    assert "Found 1 candidate pairs" in result.stdout
+
+    conn = sqlite3.connect(os.environ["DATABASE_NAME"])
+    pairs = conn.execute("SELECT id_a, id_b, score FROM duplicates").fetchall()
+    conn.close()
+    assert len(pairs) == 1
+    assert pairs[0][:2] == (1, 2)
+    assert 0.8 <= pairs[0][2] <= 1.0
+
+
+def test_find_duplicates_scores_each_pair_once():
+    db = os.environ["DATABASE_NAME"]
+    database.create_tables(db)
+    # 1 and 2 share all three keys, but their birth block (with 3 to 5) is too
+    # large, so they are scored in the death block and not again in the burial
+    # block; a second score would violate the primary key of duplicates
+    for id in range(1, 6):
+        death, burial = ("5 May 1970", "3136") if id < 3 else (None, str(id))
+        name = "John Smith"
+        pytest.helpers.make_memorial(id, name, "1 Jan 1900", death, burial).save()
+
+    counts = dedupe.find_duplicates(db, workers=1, max_block_size=4)
+    assert counts == {"blocks": 2, "skipped": 1, "pairs": 1}
+    conn = sqlite3.connect(db)
+    assert conn.execute("SELECT id_a, id_b FROM duplicates").fetchall() == [(1, 2)]
+    conn.close()
@@ -0,0 +1,247 @@
+import io
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from graver.fetcher import Fetcher, LatencyTracker, Proxy, ProxyPool
+
+
+class FakeResponse(io.BytesIO):
+    pass
+
+
+def make_opener(delays: list):
+    """Returns an urlopen stand-in that sleeps for the next delay in the list"""
+    lock = threading.Lock()
+    calls = []
+
+    def opener(req, timeout=None):
+        with lock:
+            calls.append(timeout)
+            delay = delays[min(len(calls), len(delays)) - 1]
+        time.sleep(delay)
+        return FakeResponse(req.full_url.encode())
+
+    opener.calls = calls
+    return opener
+
+
+@pytest.mark.parametrize(
+    "samples, pct, expected",
+    [
+        ([], 95, None),
+        ([0.5], 99, 0.5),
+        ([float(n) for n in range(1, 101)], 95, 95.0),
+        ([float(n) for n in range(1, 101)], 50, 50.0),
+    ],
+)
+def test_latency_tracker_percentile(samples, pct, expected):
+    tracker = LatencyTracker()
+    for sample in samples:
+        tracker.add(sample)
+    assert tracker.percentile(pct) == expected
+
+
+def test_fetcher_passes_connect_timeout():
+    opener = make_opener([0])
+    fetcher = Fetcher(connect_timeout=3.5, opener=opener)
+    assert fetcher.fetch("https://example.com/1") == b"https://example.com/1"
+    assert opener.calls == [3.5]
+    assert fetcher.hedges == 0
+
+
+def test_fetcher_hedges_slow_request():
+    # 20 fast requests establish the p95, then the primary stalls and the
+    # duplicate request returns first
+    opener = make_opener([0.001] * 20 + [2.0, 0.001])
+    fetcher = Fetcher(hedge=True, hedge_budget=0.5, opener=opener)
+    for n in range(20):
+        fetcher.fetch("https://example.com/{}".format(n))
+
+    start = time.monotonic()
+    body = fetcher.fetch("https://example.com/slow")
+    elapsed = time.monotonic() - start
+    fetcher.close()
+
+    assert body == b"https://example.com/slow"
+    assert fetcher.hedges == 1
+    assert elapsed < 1.0
+
+
+def test_fetcher_hedge_budget_exhausted():
+    opener = make_opener([0.001] * 20 + [0.2])
+    fetcher = Fetcher(hedge=True, hedge_budget=0.0, opener=opener)
+    for n in range(21):
+        fetcher.fetch("https://example.com/{}".format(n))
+    fetcher.close()
+    assert fetcher.hedges == 0
+    assert len(opener.calls) == 21
+
+
+class StalledBody(BaseHTTPRequestHandler):
+    """Sends the headers and part of the body, then stalls"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "100")
+        self.end_headers()
+        self.wfile.write(b"partial")
+        self.wfile.flush()
+        self.server.release.wait(5)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_fetcher_read_timeout_on_stalled_body():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StalledBody)
+    server.release = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fetcher = Fetcher(connect_timeout=5.0, read_timeout=0.2)
+    start = time.monotonic()
+    try:
+        with pytest.raises(TimeoutError):
+            fetcher.fetch("http://127.0.0.1:{}/".format(server.server_port))
+    finally:
+        server.release.set()
+        server.shutdown()
+        server.server_close()
+    # the read timeout, not the connect timeout, ended the read
+    assert time.monotonic() - start < 2.0
+    assert not fetcher._read_timeout_warned
+
+
+class ProxyStandIn(BaseHTTPRequestHandler):
+    """Answers proxied GETs with the proxy's port and the requested URL"""
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = "{} {}".format(self.server.server_port, self.path).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def proxy_servers():
+    servers = []
+
+    def start(status=200, delay=0.0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ProxyStandIn)
+        server.status = status
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://127.0.0.1:{}".format(server.server_port)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def unused_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}".format(sock.getsockname()[1])
+
+
+def test_fetcher_spreads_requests_across_proxies(proxy_servers):
+    urls = [proxy_servers(), proxy_servers()]
+    fetcher = Fetcher(proxies=ProxyPool.from_urls(urls, rate=1000))
+    for n in range(6):
+        body = fetcher.fetch("http://memorial.test/memorial/{}".format(n))
+        assert body.endswith("http://memorial.test/memorial/{}".format(n).encode())
+    assert [p.successes for p in fetcher.proxies.proxies] == [3, 3]
+
+
+def test_proxy_rate_budget(proxy_servers):
+    pool = ProxyPool.from_urls([proxy_servers()], rate=20)
+    fetcher = Fetcher(proxies=pool)
+    start = time.monotonic()
+    for n in range(5):
+        fetcher.fetch("http://memorial.test/memorial/{}".format(n))
+    # 5 requests at 20 requests/sec need at least 4 intervals of 50ms
+    assert time.monotonic() - start >= 0.2
+
+
+def test_proxy_circuit_breaker(proxy_servers):
+    dead = Proxy(unused_port_url(), rate=1000, failure_threshold=2, cooldown=60)
+    throttled = Proxy(proxy_servers(429), rate=1000, failure_threshold=2)
+    healthy = Proxy(proxy_servers(), rate=1000)
+    fetcher = Fetcher(proxies=ProxyPool([dead, throttled, healthy]))
+
+    failures = 0
+    for n in range(10):
+        try:
+            fetcher.fetch("http://memorial.test/memorial/{}".format(n))
+        except Exception:
+            failures += 1
+
+    assert dead.failures == 2
+    assert throttled.failures == 2
+    assert failures == 4
+    assert healthy.successes == 6
+    assert dead.is_open(time.monotonic())
+
+
+def test_hedging_ignores_proxy_rate_limit(proxy_servers):
+    # 10 requests/sec per proxy means waiting ~50ms for each slot, far longer
+    # than the responses take; that wait must not trigger hedges
+    urls = [proxy_servers(), proxy_servers()]
+    fetcher = Fetcher(
+        hedge=True, hedge_budget=0.5, proxies=ProxyPool.from_urls(urls, rate=10)
+    )
+    for n in range(30):
+        fetcher.fetch("http://memorial.test/memorial/{}".format(n))
+    fetcher.close()
+    assert fetcher.hedges <= 2
+
+
+def test_hedge_goes_to_another_proxy(proxy_servers):
+    slow = Proxy(proxy_servers(delay=1.0), rate=1000)
+    fast = Proxy(proxy_servers(), rate=1000)
+    fetcher = Fetcher(hedge=True, hedge_budget=1.0, proxies=ProxyPool([slow, fast]))
+    for _ in range(20):
+        fetcher.latency.add(0.01)
+    fetcher.requests = 20
+
+    start = time.monotonic()
+    body = fetcher.fetch("http://memorial.test/memorial/1")
+    fetcher.close()
+    assert time.monotonic() - start < 0.9
+    assert body.startswith(fast.url.rsplit(":", 1)[1].encode())
+    assert fetcher.hedges == 1
+
+
+def test_no_hedge_without_another_proxy(proxy_servers):
+    fetcher = Fetcher(
+        hedge=True,
+        hedge_budget=1.0,
+        proxies=ProxyPool.from_urls([proxy_servers(delay=0.2)], rate=1000),
+    )
+    for _ in range(20):
+        fetcher.latency.add(0.01)
+    fetcher.fetch("http://memorial.test/memorial/1")
+    fetcher.close()
+    assert fetcher.hedges == 0
+
+
+def test_proxy_pool_needs_proxies():
+    with pytest.raises(ValueError):
+        ProxyPool([])
+
+
+def test_fetcher_open_streams_through_proxy(proxy_servers):
+    fetcher = Fetcher(proxies=ProxyPool.from_urls([proxy_servers()], rate=1000))
+    with fetcher.open("http://memorial.test/sitemap.xml") as response:
+        assert response.read().endswith(b"http://memorial.test/sitemap.xml")
+    assert fetcher.proxies.proxies[0].successes == 1
+    assert fetcher.requests == 1
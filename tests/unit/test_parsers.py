@@ -109,3 +109,31 @@ def test_cemetery_parser_scrape(uri):
     )
     assert cem.location == "Dallas, Dallas County, Texas, USA"
     assert cem.coords == "32.86780,-96.86220"
+
+
+def test_memorial_parser_parse_family():
+    html = """
+    <h3 id="parentsLabel">Parents</h3>
+    <ul aria-labelledby="parentsLabel">
+      <li><a href="/memorial/11/father">Father</a></li>
+      <li><a href="/memorial/12/mother">Mother</a></li>
+    </ul>
+    <ul aria-labelledby="spouseLabel">
+      <li><a href="https://www.findagrave.com/memorial/13/spouse">Spouse</a></li>
+    </ul>
+    <ul aria-labelledby="childrenLabel">
+      <li><a href="/memorial/14/child">Child</a>
+      <a href="/memorial/14/child/photo">Photo</a></li>
+      <li><a href="/memorial/10/self">Self</a></li>
+    </ul>
+    <ul aria-labelledby="otherLabel">
+      <li><a href="/memorial/99/unrelated">Unrelated</a></li>
+    </ul>
+    """
+    family = MemorialParser.parse_family(BeautifulSoup(html, "lxml"), 10)
+    assert [(f.relative_id, f.relationship) for f in family] == [
+        (11, "parent"),
+        (12, "parent"),
+        (13, "spouse"),
+        (14, "child"),
+    ]
@@ -0,0 +1,152 @@
+import gzip
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from graver import sitemap
+from graver.cli import app
+from graver.fetcher import Fetcher
+from graver.parsers import get_cemetery_id_from_url
+
+NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def urlset(urls: list) -> str:
+    entries = "".join(
+        f"<url><loc>{url}</loc><priority>0.5</priority></url>" for url in urls
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{NS}">{entries}</urlset>'
+    )
+
+
+def sitemapindex(locations: list) -> str:
+    entries = "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locations)
+    return f'<?xml version="1.0"?><sitemapindex xmlns="{NS}">{entries}</sitemapindex>'
+
+
+@pytest.fixture
+def index(tmp_path):
+    memorials = tmp_path / "memorials.xml.gz"
+    with gzip.open(memorials, "wt") as f:
+        f.write(
+            urlset(
+                [
+                    "https://www.findagrave.com/memorial/534/andrew-jackson",
+                    "https://www.findagrave.com/memorial/1075",
+                    "https://www.findagrave.com/about",
+                ]
+            )
+        )
+    cemeteries = tmp_path / "cemeteries.xml"
+    cemeteries.write_text(
+        urlset(["https://www.findagrave.com/cemetery/3136/crown-hill-memorial-park"])
+    )
+    index = tmp_path / "index.xml"
+    # the memorial sitemap is listed twice but only read once
+    index.write_text(sitemapindex([memorials, cemeteries, memorials]))
+    return str(index)
+
+
+@pytest.mark.parametrize(
+    "expected_id, url",
+    [
+        (3136, "https://www.findagrave.com/cemetery/3136/crown-hill-memorial-park"),
+        (153, "https://www.findagrave.com/cemetery/153/"),
+        (None, "https://www.findagrave.com/memorial/534"),
+    ],
+)
+def test_get_cemetery_id_from_url(expected_id, url):
+    assert get_cemetery_id_from_url(url) == expected_id
+
+
+def test_discover(index):
+    assert list(sitemap.discover([index])) == [
+        ("memorial", 534),
+        ("memorial", 1075),
+        ("cemetery", 3136),
+    ]
+    assert list(sitemap.discover([index], ["cemetery"])) == [("cemetery", 3136)]
+
+
+def test_discover_closes_index_before_children(index, monkeypatch):
+    open_sitemap = sitemap.open_sitemap
+    open_now = []
+    most_open = []
+
+    @contextmanager
+    def tracking_open_sitemap(location, fetcher=None):
+        with open_sitemap(location, fetcher) as stream:
+            open_now.append(location)
+            most_open.append(len(open_now))
+            yield stream
+            open_now.remove(location)
+
+    monkeypatch.setattr(sitemap, "open_sitemap", tracking_open_sitemap)
+    assert len(list(sitemap.discover([index]))) == 3
+    assert most_open == [1, 1, 1]
+
+
+def test_discover_through_fetcher(index, tmp_path):
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(QuietHandler, directory=str(tmp_path))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{}".format(server.server_port)
+    remote = tmp_path / "remote.xml"
+    remote.write_text(sitemapindex([f"{base}/memorials.xml.gz", index]))
+    fetcher = Fetcher()
+    try:
+        found = list(sitemap.discover([f"{base}/remote.xml"], fetcher=fetcher))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert found[:2] == [("memorial", 534), ("memorial", 1075)]
+    assert ("cemetery", 3136) in found
+    assert fetcher.requests == 2
+
+
+def test_discover_does_not_expand_entities(tmp_path):
+    entity = "https://www.findagrave.com/memorial/99"
+    doc = tmp_path / "entities.xml"
+    doc.write_text(
+        f'<?xml version="1.0"?><!DOCTYPE urlset [<!ENTITY e "{entity}">]>'
+        + f'<urlset xmlns="{NS}"><url><loc>&e;</loc></url></urlset>'
+    )
+    assert list(sitemap.discover([str(doc)])) == []
+
+
+def test_cli_discover(index, tmp_path, runner):
+    output = tmp_path / "cemeteries.txt"
+    result = runner.invoke(
+        app,
+        ["discover", "--sitemap", index, "--output-file", str(output)]
+        + ["--kind", "cemetery"],
+    )
+    assert result.exit_code == 0
+    assert output.read_text().splitlines() == [
+        "https://www.findagrave.com/cemetery/3136",
+    ]
+
+
+def test_cli_discover_one_kind_per_stream(index, runner):
+    result = runner.invoke(
+        app,
+        ["discover", "--sitemap", index, "--kind", "memorial", "--kind", "cemetery"],
+    )
+    assert result.exit_code == 2
+    assert "separately" in result.output
+
+
+def test_cli_discover_to_stdout(index, runner):
+    result = runner.invoke(app, ["discover", "--sitemap", index])
+    assert result.exit_code == 0
+    assert result.stdout.splitlines()[:2] == ["534", "1075"]
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+
+import pytest
+
+from graver import database, stats
+from graver.cli import app
+from graver.memorial import Memorial
+
+
+@pytest.fixture
+def conn():
+    db = os.environ["DATABASE_NAME"]
+    database.create_tables(db)
+    conn = sqlite3.connect(db)
+    yield conn
+    conn.close()
+
+
+def all_stats(conn: sqlite3.Connection) -> set:
+    return set(conn.execute("SELECT dimension, key, count FROM stats").fetchall())
+
+
+def test_stats_incremental_matches_rebuild(conn):
+    pytest.helpers.make_memorial(
+        1, burial="3136", death="12 Oct 2011", coords="32.8,-96.8"
+    ).save()
+    pytest.helpers.make_memorial(2, burial="3136", death="1 Jan 2015").save()
+    pytest.helpers.make_memorial(3, burial="153", death="Unknown").save()
+    # replacing a memorial retracts its old statistics
+    pytest.helpers.make_memorial(
+        2, burial="153", death="3 Mar 1999", coords="1.0,2.0"
+    ).save()
+    conn.execute("DELETE FROM graves WHERE id=3")
+    conn.execute("UPDATE graves SET death='1 Jan 1950' WHERE id=1")
+    conn.commit()
+
+    incremental = all_stats(conn)
+    stats.rebuild(conn)
+    assert incremental == all_stats(conn)
+
+    assert stats.get_stats(conn, "total") == [("", 2)]
+    assert stats.get_stats(conn, "coords") == [("yes", 2)]
+    assert stats.get_stats(conn, "death_decade") == [("1950s", 1), ("1990s", 1)]
+    assert stats.get_stats(conn, "cemetery_decade", 1) == [("153|1990s", 1)]
+
+
+@pytest.mark.parametrize(
+    "insert",
+    [
+        "INSERT OR IGNORE INTO graves (id, burial) VALUES (1, '153')",
+        "INSERT INTO graves (id, burial) VALUES (1, '153') "
+        + "ON CONFLICT (id) DO UPDATE SET burial = excluded.burial",
+        "INSERT OR REPLACE INTO graves (id, burial) VALUES (1, '153')",
+    ],
+)
+def test_stats_insert_conflicts(conn, insert):
+    pytest.helpers.make_memorial(1, burial="3136").save()
+    conn.execute(insert)
+    conn.commit()
+
+    incremental = all_stats(conn)
+    stats.rebuild(conn)
+    assert incremental == all_stats(conn)
+    assert stats.get_stats(conn, "total") == [("", 1)]
+
+
+def test_stats_created_for_existing_rows(tmp_path, monkeypatch):
+    db = str(tmp_path / "old.db")
+    monkeypatch.setenv("DATABASE_NAME", db)
+    Memorial.create_table(db)
+    pytest.helpers.make_memorial(1, burial="3136", death="Oct 2011").save()
+
+    stats.create_table(db)
+    conn = sqlite3.connect(db)
+    assert stats.get_stats(conn, "cemetery") == [("3136", 1)]
+    assert stats.get_stats(conn, "death_decade") == [("2010s", 1)]
+    conn.close()
+
+
+def test_cli_stats(conn, runner):
+    pytest.helpers.make_memorial(
+        1, burial="3136", death="12 Oct 2011", coords="32.8,-96.8"
+    ).save()
+    pytest.helpers.make_memorial(2, burial=None, death=None).save()
+
+    result = runner.invoke(app, ["stats"])
+    assert result.exit_code == 0
+    assert "Memorials: 2" in result.stdout
+    assert "With coordinates: 1" in result.stdout
+
+    result = runner.invoke(app, ["stats", "--by", "cemetery", "--rebuild"])
+    assert result.exit_code == 0
+    assert "3136\t1" in result.stdout
+    assert "(unknown)\t1" in result.stdout
+
+    result = runner.invoke(app, ["stats", "--by", "nonsense"])
+    assert result.exit_code != 0